@@ -0,0 +1,111 @@
+"""Hammer one restaurant with concurrent bookings and cancellations, then check capacity.
+
+Runs against a throwaway SQLite database and exits non-zero if any time slot was
+overbooked, i.e. if its occupancy exceeds the restaurant's tables or disagrees with the
+bookings actually stored for it.
+
+    python benchmarks/booking_stress.py --threads 16 --attempts 200 --tables 25
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restroo import app, db  # noqa: E402
+from restroo.booking import BookingError, cancel_booking, reserve_tables, upcoming_slots  # noqa: E402
+from restroo.models import Booking, SlotOccupancy, Tables, User  # noqa: E402
+
+
+def make_user(username, role):
+    return User(name=username, username=username, email=f'{username}@example.com', address='-', contact=0,
+                role=role, password='-')
+
+
+def setup(tables, threads):
+    db.create_all()
+    rest = make_user('stress_rest', 'restaurant')
+    customers = [make_user(f'stress_cust{i}', 'customer') for i in range(threads)]
+    db.session.add_all([rest] + customers)
+    db.session.commit()
+    db.session.add(Tables(total=tables, available=tables, rest_id=rest.id))
+    db.session.commit()
+    return rest.id, [customer.id for customer in customers]
+
+
+def worker(rest_id, cust_id, slots, attempts, cancel_ratio, counters, lock):
+    with app.app_context():
+        rest = User.query.get(rest_id)
+        customer = User.query.get(cust_id)
+        mine = []
+        for _ in range(attempts):
+            try:
+                if mine and random.random() < cancel_ratio:
+                    cancel_booking(Booking.query.get(mine.pop()))
+                    outcome = 'cancelled'
+                else:
+                    booking = reserve_tables(customer, rest, random.randint(1, 3), random.choice(slots))
+                    mine.append(booking.id)
+                    outcome = 'booked'
+            except BookingError:
+                outcome = 'rejected'
+            with lock:
+                counters[outcome] += 1
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=200, help='Operations per thread.')
+    parser.add_argument('--tables', type=int, default=25)
+    parser.add_argument('--slots', type=int, default=3, help='Number of time slots to spread bookings over.')
+    parser.add_argument('--cancel-ratio', type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'stress.db')
+        with app.app_context():
+            rest_id, customer_ids = setup(args.tables, args.threads)
+            slots = list(upcoming_slots(app.config['BOOKING_DAYS_AHEAD']))[-args.slots:]
+
+        counters = {'booked': 0, 'cancelled': 0, 'rejected': 0}
+        lock = threading.Lock()
+        threads = [threading.Thread(target=worker,
+                                    args=(rest_id, cust_id, slots, args.attempts, args.cancel_ratio, counters, lock))
+                   for cust_id in customer_ids]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            total = Tables.query.filter_by(rest_id=rest_id).one().total
+            occupancy = dict(db.session.query(SlotOccupancy.slot_start, SlotOccupancy.booked)
+                             .filter(SlotOccupancy.rest_id == rest_id))
+            booked = dict(db.session.query(Booking.slot_start, db.func.sum(Booking.number_of_table))
+                          .filter(Booking.rest_id == rest_id).group_by(Booking.slot_start))
+            db.session.remove()
+        db.get_engine(app).dispose()
+
+    total_ops = sum(counters.values())
+    print(f"{total_ops} operations in {elapsed:.2f}s ({total_ops / elapsed:.0f} ops/s): {counters}")
+    failed = False
+    for slot in slots:
+        print(f"{slot:%Y-%m-%d %H:%M} tables={total} occupancy={occupancy.get(slot, 0)} booked={booked.get(slot, 0)}")
+        if occupancy.get(slot, 0) > total or occupancy.get(slot, 0) != booked.get(slot, 0):
+            failed = True
+    if failed:
+        print('FAIL: capacity invariant violated')
+        sys.exit(1)
+    print('OK: capacity never exceeded')
+
+
+if __name__ == '__main__':
+    main()
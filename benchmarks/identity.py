@@ -0,0 +1,95 @@
+"""Compare authenticated page views with and without the cached identity loader.
+
+Builds a throwaway SQLite database with one restaurant and one customer, logs both in and
+requests their pages repeatedly, reporting time and SQL statements per request. Page caching
+is switched off so every request runs its view.
+
+    python benchmarks/identity.py --requests 500
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restroo import app, db  # noqa: E402
+from restroo.identity import identity_cache  # noqa: E402
+from restroo.models import Tables, User  # noqa: E402
+
+app.config['PAGE_CACHE'] = False
+app.config['QUERY_ACCOUNTING'] = True
+
+
+def make_user(username, role):
+    return User(name=username, username=username, email=f'{username}@example.com', address='-', contact=0,
+                role=role, password='-')
+
+
+def setup():
+    db.create_all()
+    rest, customer = make_user('bench_rest', 'restaurant'), make_user('bench_cust', 'customer')
+    db.session.add_all([rest, customer])
+    db.session.commit()
+    db.session.add(Tables(total=10, available=10, rest_id=rest.id))
+    db.session.commit()
+    return rest.id, customer.id
+
+
+def client_for(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def measure(client, url, requests):
+    timings, queries = [], []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+    return statistics.mean(timings) * 1000, statistics.mean(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help='Requests per route and mode.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'identity.db')
+        with app.app_context():
+            rest_id, customer_id = setup()
+        routes = [(rest_id, '/account'), (rest_id, f'/bookings/{rest_id}'), (customer_id, f'/bookings/new/{rest_id}'),
+                  (customer_id, '/restaurants')]
+        for user_id, url in routes:
+            row = {'route': url}
+            for enabled in (False, True):
+                app.config['IDENTITY_CACHE'] = enabled
+                identity_cache.clear()
+                client = client_for(user_id)
+                client.get(url)
+                row['cached' if enabled else 'uncached'] = measure(client, url, args.requests)
+            results.append(row)
+        db.get_engine(app).dispose()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'route':<24}{'uncached ms':>12}{'queries':>9}{'cached ms':>12}{'queries':>9}{'saved ms':>10}")
+    for row in results:
+        (off_ms, off_q), (on_ms, on_q) = row['uncached'], row['cached']
+        print(f"{row['route']:<24}{off_ms:>12.3f}{off_q:>9.1f}{on_ms:>12.3f}{on_q:>9.1f}{off_ms - on_ms:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Report bcrypt throughput at each work factor.
+
+For each cost, hashes on one thread (hashes/sec per core) and then on one thread per core,
+as the app's hashing slots allow, which shows whether bcrypt scales across cores. Use it to
+pick BCRYPT_LOG_ROUNDS: each step up doubles the time per login.
+
+    python benchmarks/password_hashing.py --costs 10 11 12 13 --seconds 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restroo import bcrypt  # noqa: E402
+
+
+def throughput(cost, seconds, threads):
+    def work(deadline):
+        count = 0
+        while time.perf_counter() < deadline:
+            bcrypt.generate_password_hash('correct horse battery staple', cost)
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        counts = list(executor.map(work, [start + seconds] * threads))
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--seconds', type=float, default=2, help='Hashing time per cost and thread count.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    results = []
+    for cost in args.costs:
+        single = throughput(cost, args.seconds, 1)
+        parallel = throughput(cost, args.seconds, cores)
+        results.append({'cost': cost, 'ms_per_hash': 1000 / single, 'hashes_per_sec_per_core': single,
+                        'hashes_per_sec_all_cores': parallel, 'cores': cores})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'cost':>4}{'ms/hash':>10}{'hashes/s/core':>15}{f'hashes/s x{cores}':>16}")
+    for r in results:
+        print(f"{r['cost']:>4}{r['ms_per_hash']:>10.1f}{r['hashes_per_sec_per_core']:>15.1f}"
+              f"{r['hashes_per_sec_all_cores']:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
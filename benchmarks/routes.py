@@ -0,0 +1,404 @@
+"""Load-test every route against a synthetic database and record the results as JSON.
+
+Builds a throwaway SQLite database with the requested number of restaurants, customers,
+posts, reviews, bookings and media, then drives each route in routes.py from concurrent
+Flask test clients. Each client is anonymous or logged in as a customer or a restaurant,
+as the route requires. For every route it reports p50/p95/p99 latency, throughput and
+SQL statements per request (X-Query-Count). Nothing leaves the machine. NLTK and network
+access are not needed: review scores are generated and scoring is left to queued jobs.
+
+    python benchmarks/routes.py --restaurants 200 --customers 1000 --requests 200 \\
+        --concurrency 8 --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks/routes.py --compare bench-abc123.json --output bench-def456.json
+
+Fixtures that a request consumes, such as the post a delete request removes, are created
+before the timed phase. The booking event stream stays open for minutes, so it is left out.
+
+Export bodies are streamed after the X-Query-Count header has been sent, so the header only
+covers the queries run before the first row. Their timings include reading the whole body,
+but their query counts are reported as n/a.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from restroo import aggregates, app, bcrypt, booking, db, leaderboard, migrations, search  # noqa: E402
+from restroo.booking import SLOT_FORMAT, upcoming_slots  # noqa: E402
+from restroo.forms import PostForm  # noqa: E402
+from restroo.images import folder_path  # noqa: E402
+from restroo.models import Booking, Media, Post, Review, Tables, User  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark'
+METRICS_TOKEN = 'benchmark'
+WORDS = ('great lovely awful terrible tasty bland slow friendly rude amazing cold warm delicious '
+         'disappointing spicy fresh crowded quiet cosy noisy pricey cheap generous tiny').split()
+
+# who: 'anonymous', 'customer' or 'restaurant'. path/data/prepare take (ctx, user_id, i);
+# prepare runs before timing and its result is passed to path and data as ``fixture``.
+# streamed routes run most of their queries after the X-Query-Count header is sent.
+Route = namedtuple('Route', 'name method who path data prepare fresh_session streamed headers')
+
+
+def route(name, method, who, path, data=None, prepare=None, fresh_session=False, streamed=False, headers=None):
+    return Route(name, method, who, path, data, prepare, fresh_session, streamed, headers)
+
+
+def second_page(restaurants):
+    return 2 if restaurants > app.config['DIRECTORY_PER_PAGE'] else 1
+
+
+def sentence(n):
+    return ' '.join(random.choices(WORDS, k=n))
+
+
+def build_database(args):
+    """Create the schema and fill it with synthetic rows through bulk inserts."""
+    random.seed(args.seed)
+    migrations.upgrade()
+    password = bcrypt.generate_password_hash(PASSWORD, app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+    def users(prefix, role, count):
+        return [{'name': f'{prefix.title()} {i}', 'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com',
+                 'address': 'Somewhere', 'contact': 1000 + i, 'role': role, 'password': password,
+                 'image_file': 'default.jpg'} for i in range(count)]
+
+    db.session.bulk_insert_mappings(User, users('rest', 'restaurant', args.restaurants), return_defaults=True)
+    db.session.bulk_insert_mappings(User, users('cust', 'customer', args.customers), return_defaults=True)
+    db.session.commit()
+    rest_ids = [i for i, in db.session.query(User.id).filter(User.role == 'restaurant').order_by(User.id)]
+    cust_ids = [i for i, in db.session.query(User.id).filter(User.role == 'customer').order_by(User.id)]
+    now = datetime.utcnow()
+
+    def recent():
+        return now - timedelta(minutes=random.randint(0, 60 * 24 * 90))
+
+    db.session.bulk_insert_mappings(Tables, [{'rest_id': r, 'total': 50, 'available': 50} for r in rest_ids])
+    db.session.bulk_insert_mappings(Post, [
+        {'rest_id': r, 'title': sentence(4), 'content': sentence(40), 'category': random.choice(PostForm.catt),
+         'date_posted': recent()} for r in rest_ids for _ in range(args.posts)])
+    db.session.bulk_insert_mappings(Review, [
+        {'rest_id': r, 'cust_id': random.choice(cust_ids), 'title': sentence(3), 'content': sentence(30),
+         'sentiment': round(random.random(), 2), 'date_posted': recent()} for r in rest_ids for _ in range(args.reviews)])
+    db.session.bulk_insert_mappings(Media, [
+        {'rest_id': r, 'title': sentence(2), 'content': sentence(10), 'image_file': 'missing.webp',
+         'date_posted': recent()} for r in rest_ids for _ in range(args.media)])
+    slots = list(upcoming_slots(app.config['BOOKING_DAYS_AHEAD']))
+    db.session.bulk_insert_mappings(Booking, [
+        {'rest_id': r, 'cust_id': random.choice(cust_ids), 'number_of_table': 1, 'slot_start': random.choice(slots),
+         'date_posted': recent()} for r in rest_ids for _ in range(args.bookings)])
+    db.session.commit()
+    # The derived tables the session hooks normally maintain
+    booking.rebuild_occupancy()
+    search.rebuild()
+    aggregates.rebuild()
+    leaderboard.rebuild()
+    return rest_ids, cust_ids
+
+
+class Context:
+    def __init__(self, rest_ids, cust_ids):
+        self.rest_ids = rest_ids
+        self.cust_ids = cust_ids
+        self.usernames = dict(db.session.query(User.id, User.username))
+        self.post_ids = [i for i, in db.session.query(Post.id)]
+        self.review_ids = [i for i, in db.session.query(Review.id)]
+        self.own_posts = {}
+        for post_id, rest_id in db.session.query(Post.id, Post.rest_id):
+            self.own_posts.setdefault(rest_id, []).append(post_id)
+        self.own_reviews = {}
+        for review_id, cust_id in db.session.query(Review.id, Review.cust_id):
+            self.own_reviews.setdefault(cust_id, []).append(review_id)
+        self.slots = [slot.strftime(SLOT_FORMAT) for slot in upcoming_slots(app.config['BOOKING_DAYS_AHEAD'])]
+        self._serial = iter(range(10 ** 9))
+        self._lock = threading.Lock()
+
+    def serial(self):
+        with self._lock:
+            return next(self._serial)
+
+    def account(self, user_id):
+        user = User.query.get(user_id)
+        return {'name': user.name, 'username': user.username, 'email': user.email, 'address': user.address,
+                'contact': str(user.contact), 'role': user.role}
+
+
+def make_post(ctx, rest_id, i):
+    post = Post(rest_id=rest_id, title='To delete', content=sentence(20), category=PostForm.catt[0])
+    db.session.add(post)
+    db.session.commit()
+    return post.id
+
+
+def make_review(ctx, cust_id, i):
+    review = Review(rest_id=random.choice(ctx.rest_ids), cust_id=cust_id, title='To change', content=sentence(20),
+                    sentiment=0.5)
+    db.session.add(review)
+    db.session.commit()
+    return review.id
+
+
+def make_booking(ctx, rest_id, i):
+    customer = User.query.get(random.choice(ctx.cust_ids))
+    slot = datetime.strptime(random.choice(ctx.slots), SLOT_FORMAT)
+    return booking.reserve_tables(customer, User.query.get(rest_id), 1, slot).id
+
+
+def own_post(ctx, rest_id, i):
+    return random.choice(ctx.own_posts[rest_id])
+
+
+def own_review(ctx, cust_id, i):
+    return ctx.own_reviews.get(cust_id) and random.choice(ctx.own_reviews[cust_id]) or make_review(ctx, cust_id, i)
+
+
+def post_form(ctx, user_id, i, fixture=None):
+    return {'title': sentence(4), 'content': sentence(30), 'category': random.choice(PostForm.catt)}
+
+
+def review_form(ctx, user_id, i, fixture=None):
+    return {'title': sentence(3), 'content': sentence(25)}
+
+
+def media_form(ctx, user_id, i, fixture=None):
+    # Uploads are stored under their content hash, so every request sends a different picture
+    n, image = ctx.serial(), io.BytesIO()
+    Image.new('RGB', (64, 64), (n % 256, n // 256 % 256, n // 65536 % 256)).save(image, format='PNG')
+    image.seek(0)
+    return {'title': 'Dining room', 'content': sentence(8), 'media': [(image, 'room.png')]}
+
+
+def register_form(ctx, user_id, i, fixture=None):
+    n = ctx.serial()
+    return {'name': f'New {n}', 'username': f'new{n}', 'email': f'new{n}@example.com', 'address': 'Here',
+            'contact': '123', 'password': PASSWORD, 'confirm_password': PASSWORD, 'role': 'customer', 'table': ''}
+
+
+ROUTES = [
+    route('home', 'GET', 'anonymous', lambda c, u, i: '/'),
+    route('home_page_3', 'GET', 'anonymous', lambda c, u, i: '/home?page=3'),
+    route('home_customer', 'GET', 'customer', lambda c, u, i: '/'),
+    route('about', 'GET', 'anonymous', lambda c, u, i: '/about'),
+    route('register_form', 'GET', 'anonymous', lambda c, u, i: '/register'),
+    route('register', 'POST', 'anonymous', lambda c, u, i: '/register', register_form),
+    route('login_form', 'GET', 'anonymous', lambda c, u, i: '/login'),
+    route('login', 'POST', 'anonymous', lambda c, u, i: '/login',
+          lambda c, u, i: {'email': f'cust{i % len(c.cust_ids)}@example.com', 'password': PASSWORD},
+          fresh_session=True),
+    route('logout', 'GET', 'customer', lambda c, u, i: '/logout', fresh_session=True),
+    route('account', 'GET', 'customer', lambda c, u, i: '/account'),
+    route('account_update', 'POST', 'customer', lambda c, u, i: '/account', lambda c, u, i: c.account(u)),
+    route('post', 'GET', 'anonymous', lambda c, u, i: f'/post/{random.choice(c.post_ids)}'),
+    route('post_new_form', 'GET', 'restaurant', lambda c, u, i: '/post/new'),
+    route('post_new', 'POST', 'restaurant', lambda c, u, i: '/post/new', post_form),
+    route('post_update_form', 'GET', 'restaurant', lambda c, u, i, fixture: f'/post/{fixture}/update',
+          prepare=own_post),
+    route('post_update', 'POST', 'restaurant', lambda c, u, i, fixture: f'/post/{fixture}/update', post_form,
+          prepare=own_post),
+    route('post_delete', 'POST', 'restaurant', lambda c, u, i, fixture: f'/post/{fixture}/delete',
+          prepare=make_post),
+    route('search', 'GET', 'anonymous', lambda c, u, i: f'/search?q={random.choice(WORDS)}'),
+    route('search_reviews', 'GET', 'anonymous', lambda c, u, i: f'/search?q={random.choice(WORDS)}&kind=review'),
+    route('restaurants', 'GET', 'anonymous', lambda c, u, i: '/restaurants'),
+    # The second page, when there is one; past the last page the directory is a 404 like the feeds
+    route('restaurants_available', 'GET', 'anonymous',
+          lambda c, u, i: f"/restaurants?sort=available&page={second_page(len(c.rest_ids))}"),
+    route('user_posts', 'GET', 'anonymous',
+          lambda c, u, i: f'/user_post/{c.usernames[random.choice(c.rest_ids)]}'),
+    route('review_new_form', 'GET', 'customer', lambda c, u, i: f'/review/new/{random.choice(c.rest_ids)}'),
+    route('review_new', 'POST', 'customer', lambda c, u, i: f'/review/new/{random.choice(c.rest_ids)}',
+          review_form),
+    route('reviews', 'GET', 'anonymous', lambda c, u, i: f'/reviews/{random.choice(c.rest_ids)}'),
+    route('reviews_owner', 'GET', 'restaurant', lambda c, u, i: f'/reviews/{u}'),
+    route('review', 'GET', 'anonymous', lambda c, u, i: f'/review/{random.choice(c.review_ids)}'),
+    route('review_update_form', 'GET', 'customer', lambda c, u, i, fixture: f'/review/{fixture}/update',
+          prepare=own_review),
+    route('review_update', 'POST', 'customer', lambda c, u, i, fixture: f'/review/{fixture}/update', review_form,
+          prepare=own_review),
+    route('review_delete', 'POST', 'customer', lambda c, u, i, fixture: f'/review/{fixture}/delete',
+          prepare=make_review),
+    route('bookings', 'GET', 'restaurant', lambda c, u, i: f'/bookings/{u}'),
+    route('booking_new_form', 'GET', 'customer', lambda c, u, i: f'/bookings/new/{random.choice(c.rest_ids)}'),
+    route('booking_new', 'POST', 'customer', lambda c, u, i: f'/bookings/new/{random.choice(c.rest_ids)}',
+          lambda c, u, i: {'number_of_table': '1', 'slot': random.choice(c.slots)}),
+    route('booking_delete', 'POST', 'restaurant', lambda c, u, i, fixture: f'/bookings/{fixture}/delete',
+          prepare=make_booking),
+    route('export_bookings', 'GET', 'restaurant', lambda c, u, i: f'/bookings/{u}/export.csv', streamed=True),
+    route('export_reviews', 'GET', 'restaurant', lambda c, u, i: f'/reviews/{u}/export.ndjson', streamed=True),
+    route('user_medias', 'GET', 'anonymous', lambda c, u, i: f'/user_medias/{random.choice(c.rest_ids)}'),
+    route('media_new_form', 'GET', 'restaurant', lambda c, u, i: f'/user_medias/new/{u}'),
+    route('media_new', 'POST', 'restaurant', lambda c, u, i: f'/user_medias/new/{u}', media_form),
+    route('metrics', 'GET', 'anonymous', lambda c, u, i: '/metrics',
+          headers={'Authorization': f'Bearer {METRICS_TOKEN}'}),
+]
+
+
+def client_for(user_id):
+    client = app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return client
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def run_route(spec, ctx, requests, concurrency):
+    users = {'anonymous': [None], 'customer': ctx.cust_ids, 'restaurant': ctx.rest_ids}[spec.who]
+    plan = []
+    for i in range(requests):
+        user_id = users[(i % concurrency) % len(users)]
+        kwargs = {}
+        if spec.prepare:
+            with app.app_context():
+                kwargs['fixture'] = spec.prepare(ctx, user_id, i)
+                db.session.remove()
+        with app.app_context():
+            data = spec.data(ctx, user_id, i, **kwargs) if spec.data else None
+            db.session.remove()
+        plan.append((user_id, spec.path(ctx, user_id, i, **kwargs), data))
+
+    latencies, queries, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def worker(k):
+        mine = plan[k::concurrency]
+        clients = [client_for(user_id) for user_id, _, _ in mine] if spec.fresh_session else None
+        client = None if spec.fresh_session else client_for(mine[0][0]) if mine else None
+        for n, (user_id, path, data) in enumerate(mine):
+            c = clients[n] if clients else client
+            start = time.perf_counter()
+            response = c.open(path, method=spec.method, data=data, headers=spec.headers)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            response.close()
+            with lock:
+                latencies.append(elapsed)
+                queries.append(int(response.headers.get('X-Query-Count', 0)))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'method': spec.method, 'who': spec.who, 'requests': len(latencies), 'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_request': None if spec.streamed else statistics.mean(queries),
+        'max_queries': None if spec.streamed else max(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'route':<24}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}"
+    print(header + ('  p95 vs baseline' if baseline else ''))
+    for name, r in results['routes'].items():
+        queries = 'n/a' if r['queries_per_request'] is None else f"{r['queries_per_request']:.1f}"
+        line = (f"{name:<24}{r['throughput']:>8.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                f"{queries:>9}{r['errors']:>8}")
+        old = baseline and baseline['routes'].get(name)
+        if old:
+            line += f"  {(r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:+7.1f}%"
+            if r['queries_per_request'] is not None and old['queries_per_request'] is not None \
+                    and r['queries_per_request'] != old['queries_per_request']:
+                line += f" (queries {old['queries_per_request']:.1f} -> {r['queries_per_request']:.1f})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=20, help='Posts per restaurant.')
+    parser.add_argument('--reviews', type=int, default=50, help='Reviews per restaurant.')
+    parser.add_argument('--bookings', type=int, default=10, help='Bookings per restaurant.')
+    parser.add_argument('--media', type=int, default=5, help='Media per restaurant.')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per route.')
+    parser.add_argument('--routes', nargs='+', help='Only run these routes.')
+    parser.add_argument('--no-page-cache', action='store_true', help='Render every page instead of serving the cache.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier JSON results to compare p95 latency and query counts against.')
+    args = parser.parse_args()
+
+    selected = [spec for spec in ROUTES if not args.routes or spec.name in args.routes]
+    app.config.update(WTF_CSRF_ENABLED=False, QUERY_ACCOUNTING=True, SCORING_MODE='external',
+                      IMAGE_PROCESSING='sync', PAGE_CACHE=not args.no_page_cache,
+                      METRICS=True, METRICS_TOKEN=METRICS_TOKEN,
+                      # Measures the app rather than bcrypt; see password_hashing.py for that
+                      BCRYPT_LOG_ROUNDS=4)
+    media_dir = folder_path('media_files')
+    existing_media = set(os.listdir(media_dir))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        try:
+            with app.app_context():
+                started = time.perf_counter()
+                rest_ids, cust_ids = build_database(args)
+                print(f'Built synthetic database in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+                ctx = Context(rest_ids, cust_ids)
+                db.session.remove()
+            results = {'routes': {}}
+            for spec in selected:
+                results['routes'][spec.name] = run_route(spec, ctx, args.requests, args.concurrency)
+                print(f"{spec.name}: {results['routes'][spec.name]['p95_ms']:.1f} ms p95", file=sys.stderr)
+        finally:
+            db.get_engine(app).dispose()
+            for name in set(os.listdir(media_dir)) - existing_media:
+                os.remove(os.path.join(media_dir, name))
+
+    results['meta'] = {
+        'commit': git_commit(), 'date': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'cpus': os.cpu_count(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Compare the development server (run.py) with the preforking gunicorn entry point.
+
+Starts each server against a copy of restroo/site.db, drives anonymous page views from
+concurrent client threads for a fixed time, then reports requests/sec and the memory of
+the server's processes. PSS splits pages shared copy-on-write between the processes that
+map them, so it shows what each preloaded worker really adds; RSS counts shared pages in
+every process. Linux only (reads /proc).
+
+    python benchmarks/server.py --workers 1 4 --concurrency 8 --duration 15
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+URLS = ['/', '/home', '/about', '/restaurants', '/search?q=food']
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError):
+                continue
+            if ppid == pid:
+                found.append(int(entry))
+    return found
+
+
+def memory(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key.lower()] = int(rest.split()[0]) / 1024
+    return values
+
+
+def wait_for(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/about')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def load(port, concurrency, duration):
+    counts = {'ok': 0, 'error': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        i = offset
+        while time.monotonic() < deadline:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request('GET', URLS[i % len(URLS)])
+                response = conn.getresponse()
+                response.read()
+                outcome = 'ok' if response.status == 200 else 'error'
+            except OSError:
+                outcome = 'error'
+            finally:
+                conn.close()
+            i += 1
+            with lock:
+                counts[outcome] += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts, time.monotonic() - start
+
+
+def run(name, command, port, env, args):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    try:
+        wait_for(port)
+        load(port, args.concurrency, 2)
+        counts, elapsed = load(port, args.concurrency, args.duration)
+        # run.py's reloader and gunicorn's master both serve from child processes
+        pids = [process.pid] + children(process.pid)
+        processes = [dict(memory(pid), pid=pid, role='master' if pid == process.pid else 'worker') for pid in pids]
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=60)
+    workers = [p for p in processes if p['role'] == 'worker']
+    return {
+        'server': name,
+        'requests': counts['ok'],
+        'errors': counts['error'],
+        'requests_per_sec': counts['ok'] / elapsed,
+        'workers': len(workers),
+        'rss_per_worker_mb': sum(p['rss'] for p in workers) / max(len(workers), 1),
+        'pss_per_worker_mb': sum(p['pss'] for p in workers) / max(len(workers), 1),
+        'total_pss_mb': sum(p['pss'] for p in processes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='gunicorn worker counts to try.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads.')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds of load per server.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(os.path.join(ROOT, 'restroo', 'site.db'), os.path.join(tmp, 'site.db'))
+        env = dict(os.environ, RESTROO_DATABASE_URL='sqlite:///' + os.path.join(tmp, 'site.db'),
+                   RESTROO_PAGE_CACHE='0', PYTHONPATH=ROOT)
+        results = [run('run.py', [sys.executable, 'run.py'], 5000, env, args)]
+        for workers in args.workers:
+            results.append(run(f'gunicorn x{workers}', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                               8765, dict(env, RESTROO_WORKERS=str(workers), RESTROO_BIND='127.0.0.1:8765'), args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'server':<14}{'req/s':>9}{'errors':>8}{'workers':>9}{'RSS/worker':>12}{'PSS/worker':>12}{'total PSS':>11}")
+    for r in results:
+        print(f"{r['server']:<14}{r['requests_per_sec']:>9.1f}{r['errors']:>8}{r['workers']:>9}"
+              f"{r['rss_per_worker_mb']:>10.1f}MB{r['pss_per_worker_mb']:>10.1f}MB{r['total_pss_mb']:>9.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measure how long `import restroo` takes in a fresh interpreter.
+
+cold: every run gets an empty bytecode cache, so all modules are compiled again.
+warm: runs share a primed bytecode cache, like a restarted worker on a deployed host.
+
+Also reports the one-off cost of loading the sentiment models through the warm-up hook.
+
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import restroo
+t1 = time.perf_counter()
+result = {'import': t1 - t0}
+if %(warm_up)r:
+    from restroo.sentiment import warm_up
+    warm_up()
+    result['warm_up'] = time.perf_counter() - t1
+print(json.dumps(result))
+"""
+
+
+def run_probe(pycache_prefix, warm_up=False):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache_prefix)
+    env.pop('RESTROO_NLTK_PRELOAD', None)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    out = subprocess.run([sys.executable, '-c', PROBE % {'warm_up': warm_up}], cwd=ROOT, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {'min_ms': round(min(samples) * 1000, 1),
+            'median_ms': round(statistics.median(samples) * 1000, 1),
+            'max_ms': round(max(samples) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    cold = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as prefix:
+            cold.append(run_probe(prefix)['import'])
+
+    with tempfile.TemporaryDirectory() as prefix:
+        run_probe(prefix, warm_up=True)
+        warm, warm_up = [], []
+        for _ in range(args.runs):
+            result = run_probe(prefix, warm_up=True)
+            warm.append(result['import'])
+            warm_up.append(result['warm_up'])
+
+    results = {'import_cold': summarize(cold), 'import_warm': summarize(warm), 'sentiment_warm_up': summarize(warm_up)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, stats in results.items():
+            print(f"{name:<18} min {stats['min_ms']:>8} ms  median {stats['median_ms']:>8} ms  "
+                  f"max {stats['max_ms']:>8} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# gunicorn -c gunicorn.conf.py
+#
+# RESTROO_WORKERS sets the worker count (default 2 per CPU + 1). Send the master HUP to
+# replace the workers gracefully with the same code, TTIN/TTOU to add or remove a worker,
+# and USR2 followed by QUIT to the old master to roll out new code without dropping
+# connections.
+import multiprocessing
+import os
+
+from gunicorn.workers.gthread import ThreadWorker
+from gunicorn.workers.sync import SyncWorker
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('RESTROO_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('RESTROO_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('RESTROO_THREADS', 1))
+preload_app = True
+timeout = int(os.environ.get('RESTROO_WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('RESTROO_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.environ.get('RESTROO_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('RESTROO_ACCESS_LOG')
+
+
+def on_starting(server):
+    # Values saved by the workers of an earlier run would be added to the new totals
+    directory = os.environ.get('RESTROO_METRICS_DIR')
+    if directory and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            os.remove(entry.path)
+
+
+def post_fork(server, worker):
+    # Forked workers inherit the master's random state, and its metrics from warming up
+    import random
+
+    from restroo import app, metrics
+
+    random.seed()
+    metrics.reset()
+    # An event stream served by a worker holds one of its threads for as long as it is open. A
+    # sync worker has only the one, so it never holds a stream: each request gets the current
+    # availability and a retry delay, and the page polls. Threaded workers give streams at most
+    # half their threads; async workers are left to EVENTS_MAX_STREAMS.
+    if isinstance(worker, SyncWorker):
+        app.config['EVENTS_MAX_STREAMS'] = 0
+    elif isinstance(worker, ThreadWorker) and 'RESTROO_EVENTS_MAX_STREAMS' not in os.environ:
+        app.config['EVENTS_MAX_STREAMS'] = worker.cfg.threads // 2
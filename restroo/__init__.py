@@ -1,15 +1,126 @@
+import os
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 
+from restroo.database import Database
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '5791628bb0b13ce0c676dfde280ba245'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('RESTROO_DATABASE_URL', 'sqlite:///site.db')
+# Connection pool for server databases, and for SQLite files (0 reopens a SQLite connection per session)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('RESTROO_DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('RESTROO_DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('RESTROO_DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('RESTROO_DB_POOL_RECYCLE', 1800))
+# Pragmas set on every SQLite connection. WAL lets readers run alongside the single writer, and writers
+# wait up to SQLITE_BUSY_TIMEOUT ms for the lock instead of failing with "database is locked".
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('RESTROO_SQLITE_JOURNAL_MODE', 'wal')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('RESTROO_SQLITE_SYNCHRONOUS', 'normal')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('RESTROO_SQLITE_BUSY_TIMEOUT', 5000))
+# Negative values are KiB, positive values are pages
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('RESTROO_SQLITE_CACHE_SIZE', -16000))
+app.config['NLTK_DATA'] = os.environ.get('RESTROO_NLTK_DATA', os.path.join(app.root_path, 'nltk_data'))
+app.config['NLTK_PRELOAD'] = os.environ.get('RESTROO_NLTK_PRELOAD') == '1'
+app.config['SENTIMENT_CACHE_SIZE'] = 1024
+# Feeds page with (date_posted, id) cursors; page-number links use an approximate count cached for
+# FEED_COUNT_TTL seconds
+app.config['FEED_PER_PAGE'] = 5
+app.config['FEED_PAGE_NUMBERS'] = True
+app.config['FEED_COUNT_TTL'] = 60
+# Per-request SQL accounting (always on in debug and testing); views over budget fail tests and log otherwise
+app.config['QUERY_ACCOUNTING'] = os.environ.get('RESTROO_QUERY_ACCOUNTING') == '1'
+app.config['QUERY_BUDGET'] = None
+# Table bookings are made per time slot; Tables.total is the capacity of each slot
+app.config['BOOKING_SLOT_MINUTES'] = 120
+app.config['BOOKING_OPEN_HOUR'] = 12
+app.config['BOOKING_CLOSE_HOUR'] = 22
+app.config['BOOKING_DAYS_AHEAD'] = 7
+# Uploaded images are stored by content hash; renditions are resized in a process pool ('process') or inline ('sync')
+app.config['IMAGE_PROCESSING'] = os.environ.get('RESTROO_IMAGE_PROCESSING', 'process')
+app.config['IMAGE_WORKERS'] = int(os.environ.get('RESTROO_IMAGE_WORKERS', 2))
+app.config['IMAGE_FORMAT'] = os.environ.get('RESTROO_IMAGE_FORMAT', 'webp')
+app.config['IMAGE_UPLOAD_TMP'] = None
+app.config['IMAGE_MAX_BYTES'] = 10 * 1024 * 1024
+app.config['MEDIA_MAX_FILES'] = 50
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024
+app.config['IMAGE_RENDITIONS'] = {
+    'profile_pics': {'': (125, 125)},
+    'media_files': {'thumb': (160, 160), '': (500, 500), 'full': (1600, 1600)},
+}
+# Booking pages receive slot availability, and owners new bookings, over Server-Sent Events. Processes pass events
+# to each other through Unix sockets in EVENTS_DIR. In production `flask events-server` serves every stream from one
+# loop on EVENTS_BIND. Streams served by the app itself hold a server thread each, so at most EVENTS_MAX_STREAMS are
+# open per process (gunicorn.conf.py allows none on sync workers and half the threads of threaded ones) and each ends
+# after EVENTS_STREAM_SECONDS, when the browser reconnects. Past the limit a request gets the current availability
+# and reconnects after EVENTS_RETRY_MS. The events server drops listeners with over EVENTS_MAX_BUFFER bytes unsent.
+app.config['EVENTS_MAX_STREAMS'] = int(os.environ.get('RESTROO_EVENTS_MAX_STREAMS', 100))
+app.config['EVENTS_DIR'] = os.environ.get('RESTROO_EVENTS_DIR', os.path.join(app.instance_path, 'events'))
+app.config['EVENTS_BIND'] = os.environ.get('RESTROO_EVENTS_BIND', '127.0.0.1:8001')
+app.config['EVENTS_MAX_BUFFER'] = 256 * 1024
+app.config['EVENTS_STREAM_SECONDS'] = 300
+app.config['EVENTS_KEEPALIVE'] = 15
+app.config['EVENTS_RETRY_MS'] = 5000
+app.config['EVENTS_HISTORY'] = 100
+app.config['SEARCH_PER_PAGE'] = 10
+app.config['DIRECTORY_PER_PAGE'] = 20
+# Exports are streamed EXPORT_CHUNK_SIZE rows at a time
+app.config['EXPORT_CHUNK_SIZE'] = 1000
+# Rows per transaction for `flask import-data`
+app.config['IMPORT_BATCH_SIZE'] = 1000
+# Rendered public pages are cached per viewer and invalidated by tag when the underlying rows change.
+# 'local' keeps entries in each process; 'file' shares them between the worker processes on a host. Either
+# way the tag versions are files in PAGE_CACHE_TAGS_DIR, which every process writing to the database must
+# share (workers and CLI commands alike), or they go on serving pages from before the write.
+app.config['PAGE_CACHE'] = os.environ.get('RESTROO_PAGE_CACHE', '1') == '1'
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('RESTROO_PAGE_CACHE_BACKEND', 'local')
+app.config['PAGE_CACHE_DIR'] = os.environ.get('RESTROO_PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache'))
+app.config['PAGE_CACHE_TAGS_DIR'] = os.environ.get('RESTROO_PAGE_CACHE_TAGS_DIR',
+                                                 os.path.join(app.instance_path, 'cache_tags'))
+app.config['PAGE_CACHE_SIZE'] = 1024
+app.config['PAGE_CACHE_TTL'] = 300
+# The logged-in user's row is cached per process for IDENTITY_CACHE_TTL seconds, saving a query per request
+app.config['IDENTITY_CACHE'] = os.environ.get('RESTROO_IDENTITY_CACHE', '1') == '1'
+app.config['IDENTITY_CACHE_SIZE'] = 4096
+app.config['IDENTITY_CACHE_TTL'] = 30
+# Review scoring: 'thread' scores in a local worker pool, 'external' leaves jobs to `flask score-reviews`
+app.config['SCORING_MODE'] = os.environ.get('RESTROO_SCORING_MODE', 'thread')
+app.config['SCORING_WORKERS'] = int(os.environ.get('RESTROO_SCORING_WORKERS', 2))
+app.config['SCORING_BATCH_SIZE'] = 50
+app.config['SCORING_MAX_ATTEMPTS'] = 5
+# A job still 'running' after this many seconds is assumed lost with its worker and may be claimed again
+app.config['SCORING_STALE_SECONDS'] = 300
+# bcrypt work factor for new hashes; older, cheaper hashes are upgraded on the next successful login.
+# At most PASSWORD_HASH_SLOTS hashes run at once across every process on the host, each holding a lock file
+# in PASSWORD_HASH_DIR; a login that finds no free slot within PASSWORD_HASH_WAIT seconds is turned away
+# instead of tying up the workers serving the rest of the site.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('RESTROO_BCRYPT_ROUNDS', 12))
+app.config['PASSWORD_HASH_SLOTS'] = int(os.environ.get('RESTROO_PASSWORD_HASH_SLOTS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_DIR'] = os.environ.get('RESTROO_PASSWORD_HASH_DIR',
+                                                os.path.join(app.instance_path, 'password_slots'))
+app.config['PASSWORD_HASH_WAIT'] = 1
+# Prometheus metrics served on /metrics to scrapers sending "Authorization: Bearer <METRICS_TOKEN>"; without a
+# token the endpoint does not exist and, unless RESTROO_METRICS=1, nothing is collected. Under gunicorn, point
+# METRICS_DIR at a directory the workers share so the endpoint reports every worker; each worker saves its values
+# there every METRICS_FLUSH_INTERVAL seconds.
+app.config['METRICS_TOKEN'] = os.environ.get('RESTROO_METRICS_TOKEN')
+app.config['METRICS'] = os.environ.get('RESTROO_METRICS', '1' if app.config['METRICS_TOKEN'] else '0') == '1'
+app.config['METRICS_DIR'] = os.environ.get('RESTROO_METRICS_DIR')
+app.config['METRICS_FLUSH_INTERVAL'] = 1
+# Requests slower than PROFILE_SLOW_REQUESTS seconds (0 turns profiling off) have their stacks, sampled every
+# PROFILE_INTERVAL seconds, written to PROFILE_DIR in folded flame graph format
+app.config['PROFILE_SLOW_REQUESTS'] = float(os.environ.get('RESTROO_PROFILE_SLOW_REQUESTS', 0))
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_DIR'] = os.environ.get('RESTROO_PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+db = Database(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
-from restroo import routes
\ No newline at end of file
+from restroo import (routes, scoring, sentiment, querystats, booking, search, cache, aggregates, leaderboard,
+                     identity, migrations, passwords, export, importer, metrics, profiler, events, eventserver)
+
+if app.config['NLTK_PRELOAD']:
+    sentiment.warm_up()
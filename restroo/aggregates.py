@@ -0,0 +1,132 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import inspect
+
+from restroo import app, db
+from restroo.models import Review, ReviewAggregate, ReviewDaily, ReviewHistogram
+
+HISTOGRAM_BUCKETS = 10
+
+
+def bucket(score):
+    return min(int(score * HISTOGRAM_BUCKETS), HISTOGRAM_BUCKETS - 1)
+
+
+def _bump(session, model, key, count, amount=None):
+    # Increments in SQL so concurrent writers never lose updates; inserts the row on first use
+    table = model.__table__
+    values = {'review_count': table.c.review_count + count}
+    if amount is not None:
+        values['sentiment_sum'] = table.c.sentiment_sum + amount
+    where = [table.c[name] == value for name, value in key.items()]
+    result = session.execute(table.update().where(db.and_(*where)).values(values))
+    if not result.rowcount:
+        row = dict(key, review_count=count)
+        if amount is not None:
+            row['sentiment_sum'] = amount
+        session.execute(table.insert().values(row))
+
+
+def apply_score(session, rest_id, day, score, sign):
+    score = float(score)
+    _bump(session, ReviewAggregate, {'rest_id': rest_id}, sign, sign * score)
+    _bump(session, ReviewHistogram, {'rest_id': rest_id, 'bucket': bucket(score)}, sign)
+    _bump(session, ReviewDaily, {'rest_id': rest_id, 'day': day}, sign, sign * score)
+
+
+def apply_scores(session, scores):
+    """Add many ``(rest_id, day, score)`` triples at once, for bulk inserts that skip the flush hook."""
+    totals = defaultdict(lambda: [0, 0.0])
+    histogram = defaultdict(int)
+    daily = defaultdict(lambda: [0, 0.0])
+    for rest_id, day, score in scores:
+        score = float(score)
+        for target, key in ((totals, rest_id), (daily, (rest_id, day))):
+            target[key][0] += 1
+            target[key][1] += score
+        histogram[rest_id, bucket(score)] += 1
+    for rest_id, (count, total) in totals.items():
+        _bump(session, ReviewAggregate, {'rest_id': rest_id}, count, total)
+    for (rest_id, b), count in histogram.items():
+        _bump(session, ReviewHistogram, {'rest_id': rest_id, 'bucket': b}, count)
+    for (rest_id, day), (count, total) in daily.items():
+        _bump(session, ReviewDaily, {'rest_id': rest_id, 'day': day}, count, total)
+
+
+def update_review_aggregates(session, flush_context):
+    # Run on every flush by leaderboard.update_leaderboard, ahead of the ranking that reads it.
+    # Only scored reviews count, so the aggregates move whenever a sentiment value appears,
+    # changes or disappears: scoring, re-queueing an edited review, or deleting it.
+    for obj in session.new:
+        if isinstance(obj, Review) and obj.sentiment is not None:
+            apply_score(session, obj.rest_id, obj.date_posted.date(), obj.sentiment, 1)
+    for obj in session.dirty:
+        if not isinstance(obj, Review):
+            continue
+        history = inspect(obj).attrs.sentiment.history
+        if not history.has_changes():
+            continue
+        for old in history.deleted:
+            if old is not None:
+                apply_score(session, obj.rest_id, obj.date_posted.date(), old, -1)
+        for new in history.added:
+            if new is not None:
+                apply_score(session, obj.rest_id, obj.date_posted.date(), new, 1)
+    for obj in session.deleted:
+        if not isinstance(obj, Review):
+            continue
+        history = inspect(obj).attrs.sentiment.history
+        for old in history.deleted or history.unchanged:
+            if old is not None:
+                apply_score(session, obj.rest_id, obj.date_posted.date(), old, -1)
+
+
+def review_summary(rest_id, days=14):
+    aggregate = ReviewAggregate.query.get(rest_id)
+    if aggregate is None or not aggregate.review_count:
+        return None
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for row in ReviewHistogram.query.filter_by(rest_id=rest_id):
+        histogram[row.bucket] = row.review_count
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily = ReviewDaily.query.filter(ReviewDaily.rest_id == rest_id, ReviewDaily.day >= since,
+                                     ReviewDaily.review_count > 0).order_by(ReviewDaily.day).all()
+    return {'count': aggregate.review_count, 'mean': aggregate.mean, 'histogram': histogram,
+            'peak': max(histogram), 'daily': daily}
+
+
+def rebuild():
+    totals = defaultdict(lambda: [0, 0.0])
+    histogram = defaultdict(int)
+    daily = defaultdict(lambda: [0, 0.0])
+    rows = db.session.query(Review.rest_id, Review.date_posted, Review.sentiment) \
+        .filter(Review.sentiment.isnot(None)).yield_per(5000)
+    for rest_id, date_posted, sentiment in rows:
+        score = float(sentiment)
+        for key, target in (((rest_id,), totals), ((rest_id, date_posted.date()), daily)):
+            target[key][0] += 1
+            target[key][1] += score
+        histogram[rest_id, bucket(score)] += 1
+
+    for model in (ReviewAggregate, ReviewHistogram, ReviewDaily):
+        model.query.delete(synchronize_session=False)
+    if totals:
+        db.session.execute(ReviewAggregate.__table__.insert(),
+                           [{'rest_id': rest_id, 'review_count': count, 'sentiment_sum': total}
+                            for (rest_id,), (count, total) in totals.items()])
+        db.session.execute(ReviewHistogram.__table__.insert(),
+                           [{'rest_id': rest_id, 'bucket': b, 'review_count': count}
+                            for (rest_id, b), count in histogram.items()])
+        db.session.execute(ReviewDaily.__table__.insert(),
+                           [{'rest_id': rest_id, 'day': day, 'review_count': count, 'sentiment_sum': total}
+                            for (rest_id, day), (count, total) in daily.items()])
+    db.session.commit()
+    return len(totals)
+
+
+@app.cli.command('rebuild-review-stats')
+def rebuild_review_stats_command():
+    """Recompute the per-restaurant review aggregates from the review table."""
+    click.echo(f'Rebuilt review aggregates for {rebuild()} restaurant(s)')
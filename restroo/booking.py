@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from restroo import app, db, events
+from restroo.metrics import booking_conflicts
+from restroo.models import Booking, SlotOccupancy, Tables
+
+SLOT_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+class BookingError(Exception):
+    pass
+
+
+def slot_length():
+    return timedelta(minutes=app.config['BOOKING_SLOT_MINUTES'])
+
+
+def upcoming_slots(days, now=None):
+    # Slots are in the restaurant's wall-clock time, from opening until the last slot that ends by closing
+    now = now or datetime.now()
+    length = slot_length()
+    for day in range(days):
+        date = (now + timedelta(days=day)).date()
+        start = datetime.combine(date, datetime.min.time()) + timedelta(hours=app.config['BOOKING_OPEN_HOUR'])
+        close = datetime.combine(date, datetime.min.time()) + timedelta(hours=app.config['BOOKING_CLOSE_HOUR'])
+        while start + length <= close:
+            if start >= now:
+                yield start
+            start += length
+
+
+def is_bookable_slot(slot_start, now=None):
+    now = now or datetime.now()
+    days = (slot_start.date() - now.date()).days + 1
+    if not 0 < days <= app.config['BOOKING_DAYS_AHEAD']:
+        return False
+    return slot_start in set(upcoming_slots(days, now))
+
+
+def capacity(rest_id):
+    return db.session.query(Tables.total).filter(Tables.rest_id == rest_id).scalar()
+
+
+def availability(rest_id, days=None, now=None, total=None):
+    """List ``(slot_start, available)`` for the next ``days`` days.
+
+    Reads only the restaurant's capacity, unless ``total`` is given, and its occupancy rows in
+    the window, which the (rest_id, slot_start) unique index serves directly, so it never
+    scans bookings.
+    """
+    days = days or app.config['BOOKING_DAYS_AHEAD']
+    total = capacity(rest_id) if total is None else total
+    if total is None:
+        return None
+    slots = list(upcoming_slots(days, now))
+    if not slots:
+        return []
+    booked = dict(db.session.query(SlotOccupancy.slot_start, SlotOccupancy.booked)
+                  .filter(SlotOccupancy.rest_id == rest_id,
+                          SlotOccupancy.slot_start >= slots[0],
+                          SlotOccupancy.slot_start <= slots[-1]))
+    return [(slot, max(total - booked.get(slot, 0), 0)) for slot in slots]
+
+
+def slot_available(rest_id, slot_start):
+    booked = db.session.query(SlotOccupancy.booked) \
+        .filter(SlotOccupancy.rest_id == rest_id, SlotOccupancy.slot_start == slot_start).as_scalar()
+    available = db.session.query(Tables.total - db.func.coalesce(booked, 0)) \
+        .filter(Tables.rest_id == rest_id).scalar()
+    return max(available or 0, 0)
+
+
+def slots_event(slots):
+    # First event of a booking stream: the availability of every upcoming slot
+    return events.format_event('slots', [{'slot': slot.strftime(SLOT_FORMAT), 'available': available}
+                                         for slot, available in slots])
+
+
+def publish_availability(rest_id, slot_start):
+    events.publish(rest_id, 'availability', {'slot': slot_start.strftime(SLOT_FORMAT),
+                                             'available': slot_available(rest_id, slot_start)})
+
+
+def _ensure_occupancy_row(rest_id, slot_start):
+    exists = db.session.query(SlotOccupancy.id).filter_by(rest_id=rest_id, slot_start=slot_start).first()
+    if exists is None:
+        try:
+            db.session.add(SlotOccupancy(rest_id=rest_id, slot_start=slot_start, booked=0))
+            db.session.commit()
+        except IntegrityError:
+            # Another request created it first
+            db.session.rollback()
+
+
+def reserve_tables(customer, restaurant, number_of_table, slot_start):
+    # The capacity check and the increment of the slot's occupancy are a single conditional
+    # UPDATE, and the booking row is committed in the same transaction, so concurrent
+    # requests can never overbook a slot.
+    if number_of_table < 1:
+        raise BookingError('Number of tables must be at least 1')
+    if not is_bookable_slot(slot_start):
+        raise BookingError('That time slot cannot be booked')
+    try:
+        if capacity(restaurant.id) is None:
+            raise BookingError('This restaurant does not take table bookings')
+        _ensure_occupancy_row(restaurant.id, slot_start)
+        total = db.session.query(Tables.total).filter(Tables.rest_id == restaurant.id).as_scalar()
+        reserved = db.session.query(SlotOccupancy) \
+            .filter(SlotOccupancy.rest_id == restaurant.id, SlotOccupancy.slot_start == slot_start,
+                    SlotOccupancy.booked + number_of_table <= total) \
+            .update({SlotOccupancy.booked: SlotOccupancy.booked + number_of_table}, synchronize_session=False)
+        if not reserved:
+            db.session.rollback()
+            booking_conflicts.inc('full')
+            raise BookingError('Number of tables you requested is not available')
+        booking = Booking(number_of_table=number_of_table, slot_start=slot_start, booker=customer,
+                          bookplace=restaurant)
+        db.session.add(booking)
+        db.session.flush()
+        event = {'id': booking.id, 'slot': slot_start.strftime(SLOT_FORMAT), 'number_of_table': number_of_table,
+                 'customer': customer.username}
+        db.session.commit()
+    except OperationalError:
+        db.session.rollback()
+        booking_conflicts.inc('busy')
+        raise BookingError('The restaurant is busy right now, please try again')
+    # Published once committed, so open pages never see a booking that was rolled back
+    publish_availability(restaurant.id, slot_start)
+    events.publish(restaurant.id, 'booking', event, private=True)
+    return booking
+
+
+def cancel_booking(booking):
+    rest_id, slot_start = booking.rest_id, booking.slot_start
+    event = {'id': booking.id, 'slot': slot_start and slot_start.strftime(SLOT_FORMAT)}
+    try:
+        if booking.slot_start is None:
+            db.session.query(Tables) \
+                .filter(Tables.rest_id == booking.rest_id,
+                        Tables.available + booking.number_of_table <= Tables.total) \
+                .update({Tables.available: Tables.available + booking.number_of_table},
+                        synchronize_session=False)
+        else:
+            db.session.query(SlotOccupancy) \
+                .filter(SlotOccupancy.rest_id == booking.rest_id, SlotOccupancy.slot_start == booking.slot_start,
+                        SlotOccupancy.booked >= booking.number_of_table) \
+                .update({SlotOccupancy.booked: SlotOccupancy.booked - booking.number_of_table},
+                        synchronize_session=False)
+        db.session.delete(booking)
+        db.session.commit()
+    except OperationalError:
+        db.session.rollback()
+        raise BookingError('The restaurant is busy right now, please try again')
+    if slot_start is not None:
+        publish_availability(rest_id, slot_start)
+    events.publish(rest_id, 'cancelled', event, private=True)
+
+
+def rebuild_occupancy():
+    SlotOccupancy.query.delete(synchronize_session=False)
+    rows = db.session.query(Booking.rest_id, Booking.slot_start, db.func.sum(Booking.number_of_table)) \
+        .filter(Booking.slot_start.isnot(None)) \
+        .group_by(Booking.rest_id, Booking.slot_start).all()
+    count = 0
+    for rest_id, slot_start, booked in rows:
+        db.session.add(SlotOccupancy(rest_id=rest_id, slot_start=slot_start, booked=booked))
+        count += 1
+    db.session.commit()
+    return count
+
+
+@app.cli.command('rebuild-slots')
+def rebuild_slots_command():
+    """Recompute per-slot occupancy from the booking table."""
+    click.echo(f'Rebuilt {rebuild_occupancy()} slot occupancy row(s)')
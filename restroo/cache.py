@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, has_request_context, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event
+
+from restroo import app, db
+from restroo.models import Booking, Media, Post, Review, User
+
+
+class LocalCache:
+    """In-process LRU with per-entry TTL."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileCache:
+    """Page cache shared by every worker process on a host, one file per key.
+
+    Each file holds a JSON line with the expiry time and the entry's metadata, then the body.
+    Not pickle, which would run code planted by anyone able to write to the directory.
+    """
+
+    def __init__(self, directory, max_size, ttl):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, mimetype, etag, last_modified, versions = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires < time.time():
+            return None
+        return body, mimetype, etag, datetime.utcfromtimestamp(last_modified), versions
+
+    def set(self, key, value, ttl=None):
+        body, mimetype, etag, last_modified, versions = value
+        header = [time.time() + (ttl or self.ttl), mimetype, etag,
+                  last_modified.replace(tzinfo=timezone.utc).timestamp(), versions]
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(body)
+        os.replace(tmp, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.tmp'):
+                entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_size, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            os.remove(entry.path)
+
+
+def make_cache():
+    if app.config['PAGE_CACHE_BACKEND'] == 'file':
+        return FileCache(app.config['PAGE_CACHE_DIR'], app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+    return LocalCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+
+
+page_cache = make_cache()
+
+
+class TagVersions:
+    """The current version of each cache tag, one file per tag.
+
+    Every process on the host reads and bumps the same files, CLI commands included, so a
+    write made anywhere retires the pages every worker built from the old version.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tag):
+        return os.path.join(self.directory, tag)
+
+    def get(self, tag):
+        try:
+            with open(self._path(tag)) as f:
+                version = f.read()
+        except OSError:
+            version = None
+        return version or self.bump(tag)
+
+    def bump(self, tag):
+        version = uuid.uuid4().hex
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.replace(tmp, self._path(tag))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self.prune()
+        return version
+
+    def prune(self):
+        # Tags that have not changed in a while; forgetting one only retires the pages built from it
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+tag_versions = TagVersions(app.config['PAGE_CACHE_TAGS_DIR'], app.config['PAGE_CACHE_TTL'])
+
+
+# Entries remember the version of every tag they were built from and are only served while
+# all of them are current, so bumping a tag's version retires those pages without scanning
+# the cache.
+def tag_version(tag):
+    return tag_versions.get(tag)
+
+
+def invalidate(*tags):
+    for tag in tags:
+        tag_versions.bump(tag)
+
+
+def tags_for(obj):
+    if isinstance(obj, Post):
+        return {'posts', f'posts:{obj.rest_id}', f'post:{obj.id}'}
+    if isinstance(obj, Review):
+        return {f'reviews:{obj.rest_id}', f'review:{obj.id}'}
+    if isinstance(obj, Media):
+        return {f'medias:{obj.rest_id}'}
+    if isinstance(obj, Booking):
+        return {f'bookings:{obj.rest_id}'}
+    if isinstance(obj, User):
+        return {f'user:{obj.id}'}
+    return set()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in list(session.new) + list(session.deleted):
+        tags |= tags_for(obj)
+    for obj in session.dirty:
+        # Skip objects only touched through a backref collection
+        if session.is_modified(obj, include_collections=False):
+            tags |= tags_for(obj)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_cache_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
+
+
+@event.listens_for(User, 'load')
+@event.listens_for(User, 'refresh')
+def track_rendered_user(user, *args):
+    # Usernames and pictures appear on pages about other data, so a page being cached also
+    # depends on every user it loads. The version is read now, before the page can render it.
+    if has_request_context() and 'page_tags' in g:
+        tag = f'user:{user.id}'
+        if tag not in g.page_tags:
+            g.page_tags[tag] = tag_version(tag)
+
+
+def skip_page_cache():
+    """Keep the page being rendered out of the cache, e.g. while it shows a placeholder."""
+    if has_request_context():
+        g.page_uncacheable = True
+
+
+def viewer():
+    # Every page renders the navbar for the current user, and some add owner-only blocks
+    if current_user.is_authenticated:
+        return f'{current_user.id}:{current_user.role}'
+    return 'anonymous'
+
+
+def is_current(entry):
+    return all(tag_version(tag) == version for tag, version in entry[4].items())
+
+
+def cached_page(tags):
+    """Cache a GET view's rendered page and answer repeat requests with 304.
+
+    ``tags`` is a callable receiving the view arguments and returning the tags the page
+    depends on; the users it loads while rendering are added to them.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(**kwargs):
+            if not app.config['PAGE_CACHE'] or session.get('_flashes'):
+                return f(**kwargs)
+            key = '|'.join(['page', request.endpoint, repr(sorted(kwargs.items())),
+                            repr(sorted(request.args.items(multi=True))), viewer()])
+            entry = page_cache.get(key)
+            if entry is None or not is_current(entry):
+                page_tags = set(tags(**kwargs))
+                if current_user.is_authenticated:
+                    # Loaded before rendering starts, often from the identity cache
+                    page_tags.add(f'user:{current_user.id}')
+                g.page_tags = {tag: tag_version(tag) for tag in page_tags}
+                g.page_uncacheable = False
+                try:
+                    response = make_response(f(**kwargs))
+                finally:
+                    versions = g.pop('page_tags')
+                if response.status_code != 200 or g.pop('page_uncacheable'):
+                    return response
+                body = response.get_data()
+                entry = (body, response.mimetype, hashlib.sha1(body).hexdigest(), datetime.utcnow(), versions)
+                page_cache.set(key, entry)
+            body, mimetype, etag, last_modified, _ = entry
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
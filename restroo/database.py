@@ -0,0 +1,57 @@
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'}
+SYNCHRONOUS = {'off', 'normal', 'full', 'extra'}
+
+
+def sqlite_pragmas(config):
+    journal_mode = config['SQLITE_JOURNAL_MODE'].lower()
+    synchronous = config['SQLITE_SYNCHRONOUS'].lower()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f'Unknown SQLITE_JOURNAL_MODE {journal_mode!r}')
+    if synchronous not in SYNCHRONOUS:
+        raise ValueError(f'Unknown SQLITE_SYNCHRONOUS {synchronous!r}')
+    # busy_timeout comes first so that switching the journal mode also waits for other writers
+    return [f"busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}", f'journal_mode = {journal_mode}',
+            f'synchronous = {synchronous}', f"cache_size = {int(config['SQLITE_CACHE_SIZE'])}"]
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy with engine settings taken from the app config.
+
+    SQLite connections get the ``SQLITE_*`` pragmas as they are opened and are kept in a
+    small pool instead of being reopened for every session; server databases get the
+    ``DB_POOL_*`` sizing and are pinged before a pooled connection is reused.
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        config = app.config
+        if sa_url.drivername.startswith('sqlite'):
+            if sa_url.database not in (None, '', ':memory:') and config['DB_POOL_SIZE']:
+                options.setdefault('poolclass', QueuePool)
+                options.setdefault('pool_size', config['DB_POOL_SIZE'])
+                options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+                options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+        else:
+            options.setdefault('pool_size', config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+            options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+            options.setdefault('pool_pre_ping', True)
+        super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            pragmas = sqlite_pragmas(self.get_app().config)
+
+            @event.listens_for(engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute('PRAGMA ' + pragma)
+                cursor.close()
+        return engine
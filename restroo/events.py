@@ -0,0 +1,167 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+
+from restroo import app
+
+Event = namedtuple('Event', 'seq private text')
+
+
+def format_event(kind, data):
+    return f'event: {kind}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class Channel:
+    def __init__(self, history):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=history)
+        self.seq = 0
+
+
+class Broker:
+    """In-process fan-out of restaurant events to the open event streams.
+
+    Each event is formatted once into its restaurant's shared buffer and every listener reads
+    from there, so publishing costs the same however many pages are listening, and an idle
+    listener is just a thread waiting on the channel's condition.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def channel(self, rest_id):
+        with self._lock:
+            channel = self._channels.get(rest_id)
+            if channel is None:
+                channel = self._channels[rest_id] = Channel(self.history)
+            return channel
+
+    def publish(self, rest_id, kind, data, private=False):
+        channel = self.channel(rest_id)
+        with channel.condition:
+            channel.seq += 1
+            channel.events.append(Event(channel.seq, private, format_event(kind, data)))
+            channel.condition.notify_all()
+
+    def cursor(self, rest_id):
+        channel = self.channel(rest_id)
+        with channel.condition:
+            return channel.seq
+
+    def wait(self, rest_id, after, timeout):
+        """Return ``(cursor, events)`` with the events published after ``after``, waiting up to ``timeout``."""
+        channel = self.channel(rest_id)
+        with channel.condition:
+            channel.condition.wait_for(lambda: channel.seq > after, timeout)
+            # Events that fell off the buffer are lost to a listener this far behind
+            return channel.seq, [event for event in channel.events if event.seq > after]
+
+
+broker = Broker(app.config['EVENTS_HISTORY'])
+
+_open_streams = 0
+_open_lock = threading.Lock()
+
+
+def open_stream():
+    # Every open stream holds a server thread, so only so many may be open per process
+    global _open_streams
+    with _open_lock:
+        if _open_streams >= app.config['EVENTS_MAX_STREAMS']:
+            return False
+        _open_streams += 1
+    start_relay()
+    return True
+
+
+def close_stream():
+    global _open_streams
+    with _open_lock:
+        _open_streams -= 1
+
+
+def opening(first):
+    # Sent on its own, a stream that ends here is reopened by the browser after EVENTS_RETRY_MS
+    return f'retry: {app.config["EVENTS_RETRY_MS"]}\n\n' + first
+
+
+def stream(rest_id, cursor, first, private=False):
+    """Yield ``first`` and then the restaurant's events as text/event-stream chunks.
+
+    Ends after EVENTS_STREAM_SECONDS, when the browser reconnects by itself; comments are sent
+    while nothing happens so proxies keep the connection open.
+    """
+    yield opening(first)
+    deadline = time.monotonic() + app.config['EVENTS_STREAM_SECONDS']
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        cursor, events = broker.wait(rest_id, cursor, min(app.config['EVENTS_KEEPALIVE'], remaining))
+        text = ''.join(event.text for event in events if private or not event.private)
+        yield text or ': keepalive\n\n'
+
+
+# With several worker processes a listener's stream is served by one worker while the booking
+# may be made on another, so published events are also sent to every worker that has a socket
+# in EVENTS_DIR. A worker binds one on its first stream.
+_relay = {}
+_relay_lock = threading.Lock()
+
+
+def socket_path(pid):
+    return os.path.join(app.config['EVENTS_DIR'], f'{pid}.sock')
+
+
+def start_relay():
+    if not app.config['EVENTS_DIR']:
+        return
+    with _relay_lock:
+        if _relay.get('pid') == os.getpid():
+            return
+        os.makedirs(app.config['EVENTS_DIR'], exist_ok=True)
+        path = socket_path(os.getpid())
+        if os.path.exists(path):
+            os.remove(path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        threading.Thread(target=_receive, args=(receiver,), name='restroo-events', daemon=True).start()
+        _relay['pid'] = os.getpid()
+
+
+def _receive(receiver):
+    while True:
+        rest_id, kind, data, private = json.loads(receiver.recv(65536))
+        broker.publish(rest_id, kind, data, private)
+
+
+def _send_to_peers(message):
+    own = os.path.basename(socket_path(os.getpid()))
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    with sender:
+        for entry in os.scandir(app.config['EVENTS_DIR']):
+            if not entry.name.endswith('.sock') or entry.name == own:
+                continue
+            try:
+                sender.sendto(message, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that has exited
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                app.logger.warning('Event stream relay to %s is backed up; dropping an event', entry.name)
+
+
+def publish(rest_id, kind, data, private=False):
+    """Send an event to the streams of ``rest_id``; ``private`` events only reach the owner."""
+    broker.publish(rest_id, kind, data, private)
+    if app.config['EVENTS_DIR'] and os.path.isdir(app.config['EVENTS_DIR']):
+        _send_to_peers(json.dumps([rest_id, kind, data, private]).encode())
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+
+import click
+from flask_login import current_user
+
+from restroo import app
+from restroo.booking import availability, slots_event
+from restroo.events import format_event, opening, socket_path
+
+EVENTS_PATH = re.compile(r'/bookings/(\d+)/events(?:\?.*)?$')
+STREAM_HEAD = (b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+               b'X-Accel-Buffering: no\r\nConnection: close\r\n\r\n')
+NOT_FOUND = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+KEEPALIVE = b': keepalive\n\n'
+
+
+class Listener:
+    def __init__(self, writer):
+        self.writer = writer
+        self.private = False
+        # Events that arrive while the first one is being read from the database
+        self.pending = []
+
+
+def first_event(rest_id, headers):
+    # Runs on an executor thread in a request context built from the listener's headers, so
+    # the session cookie says whether the restaurant's owner is listening
+    with app.test_request_context(f'/bookings/{rest_id}/events', headers=headers):
+        slots = availability(rest_id)
+        if slots is None:
+            return None
+        return slots_event(slots), current_user.is_authenticated and current_user.id == rest_id
+
+
+class EventServer:
+    """Serves the booking event streams of every worker on a host from one asyncio loop.
+
+    Workers send each event they publish to every socket in EVENTS_DIR, this server's
+    included, and it is formatted once and written to every connection listening to that
+    restaurant. An idle stream costs an open socket rather than a server thread.
+    """
+
+    def __init__(self, max_buffer):
+        self.max_buffer = max_buffer
+        self.listeners = {}
+
+    def publish(self, rest_id, kind, data, private=False):
+        listeners = self.listeners.get(rest_id)
+        if not listeners:
+            return
+        text = format_event(kind, data).encode()
+        for listener in list(listeners):
+            if listener.pending is not None:
+                listener.pending.append((private, text))
+            elif listener.private or not private:
+                self.send(listener, text)
+
+    def send(self, listener, data):
+        listener.writer.write(data)
+        if listener.writer.transport.get_write_buffer_size() > self.max_buffer:
+            # Not reading; it reconnects and starts again from the current availability
+            listener.writer.transport.abort()
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        request_line, *lines = head.decode('latin-1').split('\r\n')
+        parts = request_line.split(' ')
+        match = EVENTS_PATH.match(parts[1]) if len(parts) == 3 and parts[0] == 'GET' else None
+        if match is None:
+            writer.write(NOT_FOUND)
+            writer.close()
+            return
+        rest_id = int(match.group(1))
+        headers = [tuple(line.split(': ', 1)) for line in lines if ': ' in line]
+
+        # Listening starts before the first event is read, so nothing published in between is
+        # missed; availability events carry absolute counts, so one seen twice does no harm
+        listener = Listener(writer)
+        self.listeners.setdefault(rest_id, set()).add(listener)
+        try:
+            first = await asyncio.get_running_loop().run_in_executor(None, first_event, rest_id, headers)
+            if first is None:
+                writer.write(NOT_FOUND)
+                return
+            text, listener.private = first
+            writer.write(STREAM_HEAD + opening(text).encode())
+            pending, listener.pending = listener.pending, None
+            for private, data in pending:
+                if listener.private or not private:
+                    self.send(listener, data)
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            listeners = self.listeners[rest_id]
+            listeners.discard(listener)
+            if not listeners:
+                del self.listeners[rest_id]
+            writer.close()
+
+    async def keepalive(self):
+        # Comments keep proxies from closing quiet connections
+        while True:
+            await asyncio.sleep(app.config['EVENTS_KEEPALIVE'])
+            for listeners in list(self.listeners.values()):
+                for listener in list(listeners):
+                    if listener.pending is None:
+                        self.send(listener, KEEPALIVE)
+
+    def receive(self, receiver):
+        while True:
+            try:
+                message = receiver.recv(65536)
+            except BlockingIOError:
+                return
+            self.publish(*json.loads(message))
+
+    async def serve(self, host, port):
+        os.makedirs(app.config['EVENTS_DIR'], exist_ok=True)
+        path = socket_path(os.getpid())
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        receiver.setblocking(False)
+        loop = asyncio.get_running_loop()
+        loop.add_reader(receiver.fileno(), self.receive, receiver)
+        # Stop on SIGTERM as on Ctrl-C, so the socket is removed
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        server = await asyncio.start_server(self.handle, host, port)
+        keepalive = asyncio.ensure_future(self.keepalive())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            keepalive.cancel()
+            loop.remove_reader(receiver.fileno())
+            receiver.close()
+            os.remove(path)
+
+
+@app.cli.command('events-server')
+@click.option('--bind', help='host:port to listen on (default EVENTS_BIND).')
+def events_server_command(bind):
+    """Serve the live booking streams of every worker on this host."""
+    if not app.config['EVENTS_DIR']:
+        raise click.ClickException('EVENTS_DIR is not set, so workers have nowhere to send their events')
+    host, port = (bind or app.config['EVENTS_BIND']).rsplit(':', 1)
+    click.echo(f'Serving booking events on {host}:{port}')
+    try:
+        asyncio.run(EventServer(app.config['EVENTS_MAX_BUFFER']).serve(host, int(port)))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,121 @@
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select
+
+from restroo import app, db
+from restroo.models import Booking, Review, User
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class ExportError(Exception):
+    pass
+
+
+def _columns(kind):
+    customer = User.__table__.alias('customer')
+    if kind == 'bookings':
+        table = Booking.__table__
+        columns = [table.c.id, table.c.date_posted, table.c.slot_start, table.c.number_of_table,
+                   customer.c.username.label('customer')]
+    elif kind == 'reviews':
+        table = Review.__table__
+        columns = [table.c.id, table.c.date_posted, table.c.title, table.c.content, table.c.sentiment,
+                   customer.c.username.label('customer')]
+    else:
+        raise ExportError(f'Unknown export {kind!r}')
+    return table, columns, customer
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ExportError(f'Dates must look like 2021-04-30, not {value!r}')
+
+
+def export_query(kind, rest_id, since=None, until=None):
+    # Walks the (rest_id, date_posted) index; until is inclusive of the whole day
+    table, columns, customer = _columns(kind)
+    query = select(columns).select_from(table.join(customer, customer.c.id == table.c.cust_id)) \
+        .where(table.c.rest_id == rest_id).order_by(table.c.date_posted, table.c.id)
+    if since:
+        query = query.where(table.c.date_posted >= since)
+    if until:
+        query = query.where(table.c.date_posted < until + timedelta(days=1))
+    return query
+
+
+def _value(value):
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+
+def stream_rows(engine, query, fmt, chunk_size=None):
+    """Yield the export as encoded text, one chunk of rows at a time.
+
+    Rows come from a server-side cursor where the driver supports one (psycopg2, MySQLdb);
+    SQLite's cursor already steps through results lazily. Only ``chunk_size`` rows are
+    held in memory, however large the export.
+    """
+    chunk_size = chunk_size or app.config['EXPORT_CHUNK_SIZE']
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        keys = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(keys)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                values = [_value(value) for value in row]
+                if fmt == 'csv':
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(keys, values)), ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+
+def export_filename(kind, rest_id, fmt, since=None, until=None):
+    parts = [kind, str(rest_id)] + [d.strftime(DATE_FORMAT) for d in (since, until) if d]
+    return '-'.join(parts) + '.' + fmt
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(['bookings', 'reviews']))
+@click.argument('rest_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('--since', help='First day to include, YYYY-MM-DD.')
+@click.option('--until', help='Last day to include, YYYY-MM-DD.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+              help='File to write; defaults to standard output.')
+def export_command(kind, rest_id, fmt, since, until, output):
+    """Stream a restaurant's bookings or reviews as CSV or NDJSON."""
+    try:
+        query = export_query(kind, rest_id, parse_date(since), parse_date(until))
+    except ExportError as e:
+        raise click.BadParameter(str(e))
+    out = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in stream_rows(db.engine, query, fmt):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
@@ -1,8 +1,10 @@
+from flask import current_app
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, RadioField, TextAreaField, SelectField, \
-    MultipleFileField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
+    MultipleFileField, IntegerField
+from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, NumberRange
+from restroo.images import check_upload
 from restroo.models import User
 from flask_login import current_user
 
@@ -81,12 +83,24 @@ class ReviewForm(FlaskForm):
 
 
 class BookingForm(FlaskForm):
-    number_of_table = StringField('Number of Tables you want to book', validators=[DataRequired()])
+    number_of_table = IntegerField('Number of Tables you want to book', validators=[DataRequired(), NumberRange(min=1)])
+    slot = SelectField('Time slot', validators=[DataRequired()])
     submit = SubmitField('Book')
 
 
 class MediaForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired()])
-    media = FileField('Update profile picture',render_kw={'multiple': True})
+    media = MultipleFileField('Photos')
     content = TextAreaField('Content', validators=[DataRequired()])
     submit = SubmitField('Add')
+
+    def validate_media(self, media):
+        files = [f for f in media.data if f and f.filename]
+        if not files:
+            raise ValidationError('Please select at least one photo.')
+        if len(files) > current_app.config['MEDIA_MAX_FILES']:
+            raise ValidationError(f"You can upload at most {current_app.config['MEDIA_MAX_FILES']} photos at once.")
+        for f in files:
+            error = check_upload(f)
+            if error:
+                raise ValidationError(f'{f.filename} {error}.')
@@ -0,0 +1,45 @@
+import uuid
+
+from flask import session
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from restroo import app, db, login_manager
+from restroo.cache import LocalCache
+from restroo.models import User
+
+# Column values of recently loaded users, keyed on user id. Each entry remembers the identity
+# version it was loaded under; the version lives in the user's session cookie, so once a user
+# edits their account every worker process sees a newer version and reloads them.
+identity_cache = LocalCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+
+VERSION_KEY = '_identity_version'
+
+
+def _columns(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    if not app.config['IDENTITY_CACHE']:
+        return User.query.get(user_id)
+    version = session.get(VERSION_KEY)
+    entry = identity_cache.get(user_id)
+    if entry is not None and entry[0] == version:
+        # Rebuild a detached instance and merge it without a SELECT, so current_user is an
+        # ordinary persistent object in this request's session
+        user = User(**entry[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = User.query.get(user_id)
+    if user is not None:
+        identity_cache.set(user_id, (version, _columns(user)))
+    return user
+
+
+def forget_user(user_id):
+    """Drop a user's cached identity here and, through the session, in every other worker."""
+    identity_cache.delete(user_id)
+    session[VERSION_KEY] = uuid.uuid4().hex
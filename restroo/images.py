@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from flask import url_for
+from PIL import Image, ImageOps, features
+
+from restroo import app
+from restroo.cache import skip_page_cache
+from restroo.metrics import image_failures, image_seconds
+
+CHUNK_SIZE = 64 * 1024
+
+PLACEHOLDERS = {
+    'profile_pics': 'profile_pics/default.jpg',
+    'media_files': 'placeholder.jpg',
+}
+
+# Leading bytes of each accepted image format, checked before anything is decoded
+SIGNATURES = {
+    'jpeg': (b'\xff\xd8\xff',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+EXTENSIONS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.gif': 'gif', '.webp': 'webp'}
+
+_executor = None
+_existing = set()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=app.config['IMAGE_WORKERS'])
+    return _executor
+
+
+def output_extension(filename):
+    fmt = app.config['IMAGE_FORMAT']
+    if fmt and (fmt != 'webp' or features.check('webp')):
+        return '.' + fmt
+    return os.path.splitext(filename)[1].lower() or '.jpg'
+
+
+def rendition_name(filename, rendition=''):
+    if not rendition:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}_{rendition}{ext}'
+
+
+def folder_path(folder):
+    return os.path.join(app.root_path, 'static', folder)
+
+
+def render_image(source_path, dest_dir, filename, renditions):
+    # Runs in a worker process. Each rendition is written to a temporary name and renamed
+    # into place, so a file that exists is always complete. Returns the seconds spent.
+    start = time.perf_counter()
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            for rendition, size in renditions.items():
+                out = os.path.join(dest_dir, rendition_name(filename, rendition))
+                if os.path.exists(out):
+                    continue
+                resized = image.copy()
+                resized.thumbnail(size)
+                if out.endswith(('.jpg', '.jpeg')) and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                elif resized.mode not in ('RGB', 'RGBA', 'L'):
+                    resized = resized.convert('RGBA')
+                tmp = f'{out}.{os.getpid()}.tmp'
+                resized.save(tmp, format=Image.registered_extensions()[os.path.splitext(out)[1]])
+                os.replace(tmp, out)
+    finally:
+        os.remove(source_path)
+    return time.perf_counter() - start
+
+
+def failure_marker(dest_dir, filename):
+    return os.path.join(dest_dir, filename + '.failed')
+
+
+def _record_render(folder, dest_dir, filename, render):
+    # A failed upload would otherwise show the placeholder forever; the marker lets pages say so
+    try:
+        seconds = render()
+    except Exception:
+        app.logger.exception('Could not render %s/%s', folder, filename)
+        image_failures.inc(folder)
+        open(failure_marker(dest_dir, filename), 'w').close()
+    else:
+        image_seconds.observe(seconds, folder)
+
+
+def sniff_format(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for fmt, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            return fmt
+    return None
+
+
+def check_upload(file_storage):
+    # Cheap checks on name, size and magic bytes; returns an error message or None
+    expected = EXTENSIONS.get(os.path.splitext(file_storage.filename)[1].lower())
+    if expected is None:
+        return 'only jpg, png, gif and webp images are allowed'
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > app.config['IMAGE_MAX_BYTES']:
+        return f"is larger than {app.config['IMAGE_MAX_BYTES'] // (1024 * 1024)} MB"
+    head = stream.read(12)
+    stream.seek(0)
+    if sniff_format(head) != expected:
+        return 'is not a valid image'
+    return None
+
+
+def spool_upload(file_storage):
+    # Streams the upload to a temporary file in chunks while hashing it
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(prefix='restroo-upload-', dir=app.config['IMAGE_UPLOAD_TMP'])
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return path, digest.hexdigest()
+
+
+def save_image(file_storage, folder):
+    """Store an uploaded image under its content hash and queue its renditions.
+
+    Returns the filename to keep on the model right away; pages show a placeholder until
+    the renditions have been written. Identical uploads map to the same files and are
+    only processed once.
+    """
+    path, digest = spool_upload(file_storage)
+    filename = digest[:32] + output_extension(file_storage.filename)
+    renditions = app.config['IMAGE_RENDITIONS'][folder]
+    dest_dir = folder_path(folder)
+    if all(os.path.exists(os.path.join(dest_dir, rendition_name(filename, r))) for r in renditions):
+        os.remove(path)
+        return filename
+    if os.path.exists(failure_marker(dest_dir, filename)):
+        os.remove(failure_marker(dest_dir, filename))
+    if app.config['IMAGE_PROCESSING'] == 'process':
+        future = get_executor().submit(render_image, path, dest_dir, filename, renditions)
+        future.add_done_callback(lambda future: _record_render(folder, dest_dir, filename, future.result))
+    else:
+        _record_render(folder, dest_dir, filename, partial(render_image, path, dest_dir, filename, renditions))
+    return filename
+
+
+def _exists(relative):
+    if relative in _existing:
+        return True
+    if os.path.exists(os.path.join(app.root_path, 'static', relative)):
+        _existing.add(relative)
+        return True
+    return False
+
+
+@app.template_global()
+def image_failed(folder, filename):
+    return os.path.exists(failure_marker(folder_path(folder), filename))
+
+
+@app.template_global()
+def image_url(folder, filename, rendition=''):
+    # Falls back from the requested rendition to the base file (older uploads have no
+    # renditions) and then to a placeholder while processing is still pending.
+    for candidate in (rendition_name(filename, rendition), filename):
+        relative = f'{folder}/{candidate}'
+        if _exists(relative):
+            return url_for('static', filename=relative)
+    if not image_failed(folder, filename):
+        # Still rendering; a cached copy would show the placeholder after the image is ready
+        skip_page_cache()
+    return url_for('static', filename=PLACEHOLDERS[folder])
@@ -0,0 +1,390 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import click
+
+from restroo import aggregates, app, bcrypt, db, leaderboard, search
+from restroo.cache import invalidate
+from restroo.forms import PostForm
+from restroo.models import ImportProgress, Media, Post, Review, ScoringJob, Tables, User
+from restroo.sentiment import sentiment_engine, warm_up
+
+# Files are imported in this order so later kinds can refer to users created by earlier ones
+KINDS = ('users', 'restaurants', 'posts', 'media', 'reviews')
+EXTENSIONS = ('.csv', '.json', '.ndjson', '.jsonl')
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportFailed(Exception):
+    pass
+
+
+def find_sources(path):
+    if os.path.isfile(path):
+        kind = os.path.splitext(os.path.basename(path))[0]
+        if kind not in KINDS:
+            raise ImportFailed(f'Cannot tell what {path} holds; name it after one of: {", ".join(KINDS)}')
+        return [(kind, path)]
+    sources = []
+    for kind in KINDS:
+        for ext in EXTENSIONS:
+            candidate = os.path.join(path, kind + ext)
+            if os.path.exists(candidate):
+                sources.append((kind, candidate))
+                break
+    return sources
+
+
+def read_rows(path):
+    """Yield ``(position, row)``; JSON files hold one array, NDJSON files one object per line."""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if ext == '.csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield f'line {reader.line_num}', row
+        elif ext == '.json':
+            for i, row in enumerate(json.load(f), 1):
+                yield f'item {i}', row
+        else:
+            for i, line in enumerate(f, 1):
+                if line.strip():
+                    yield f'line {i}', json.loads(line)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def source_key(kind, path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f'{kind}:{digest.hexdigest()}'
+
+
+# Field parsers; each raises RowError with a message naming the field
+
+def text(row, field, max_length=None, required=True):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    if max_length and len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def integer(row, field, minimum=None):
+    try:
+        value = int(str(row.get(field, '')).strip())
+    except ValueError:
+        raise RowError(f'{field} must be a whole number')
+    if minimum is not None and value < minimum:
+        raise RowError(f'{field} must be at least {minimum}')
+    return value
+
+
+def timestamp(row, field='date_posted'):
+    value = text(row, field, required=False)
+    if value is None:
+        return datetime.utcnow()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f'{field} must look like 2021-04-30 or 2021-04-30 18:30')
+
+
+def reference(row, field, users, role=None):
+    username = text(row, field)
+    user = users.get(username)
+    if user is None:
+        raise RowError(f'{field} {username!r} does not exist')
+    if role and user[1] != role:
+        raise RowError(f'{field} {username!r} is not a {role}')
+    return user[0]
+
+
+def convert_user(row, users, role):
+    mapping = {'name': text(row, 'name', 100), 'username': text(row, 'username', 20),
+               'email': text(row, 'email', 120), 'address': text(row, 'address'),
+               'contact': integer(row, 'contact'), 'role': role,
+               'image_file': text(row, 'image_file', 40, required=False) or 'default.jpg'}
+    if len(mapping['username']) < 2:
+        raise RowError('username must be at least 2 characters')
+    if '@' not in mapping['email']:
+        raise RowError('email is not an email address')
+    password_hash = text(row, 'password_hash', 60, required=False)
+    if password_hash:
+        mapping['password'] = password_hash
+    else:
+        # Hashed later, in parallel, just before the batch is inserted
+        mapping['plain_password'] = text(row, 'password')
+    if role == 'restaurant':
+        mapping['tables'] = integer(row, 'tables', minimum=1)
+    return mapping
+
+
+def convert_post(row, users):
+    category = text(row, 'category', 20)
+    if category not in PostForm.catt:
+        raise RowError(f'category must be one of: {", ".join(PostForm.catt)}')
+    return {'rest_id': reference(row, 'restaurant', users, 'restaurant'), 'title': text(row, 'title', 100),
+            'content': text(row, 'content'), 'category': category, 'date_posted': timestamp(row)}
+
+
+def convert_media(row, users):
+    return {'rest_id': reference(row, 'restaurant', users, 'restaurant'), 'title': text(row, 'title', 100),
+            'content': text(row, 'content', 500), 'image_file': text(row, 'image_file', 40),
+            'date_posted': timestamp(row)}
+
+
+def convert_review(row, users):
+    return {'rest_id': reference(row, 'restaurant', users, 'restaurant'),
+            'cust_id': reference(row, 'customer', users), 'title': text(row, 'title', 100),
+            'content': text(row, 'content'), 'date_posted': timestamp(row)}
+
+
+CONVERTERS = {
+    'users': lambda row, users: convert_user(row, users, 'customer'),
+    'restaurants': lambda row, users: convert_user(row, users, 'restaurant'),
+    'posts': convert_post,
+    'media': convert_media,
+    'reviews': convert_review,
+}
+REFERENCES = {'posts': ('restaurant',), 'media': ('restaurant',), 'reviews': ('restaurant', 'customer')}
+
+
+def lookup_users(usernames):
+    users = {}
+    usernames = list(usernames)
+    for i in range(0, len(usernames), 500):
+        for user_id, username, role in db.session.query(User.id, User.username, User.role) \
+                .filter(User.username.in_(usernames[i:i + 500])):
+            users[username] = (user_id, role)
+    return users
+
+
+def convert_batch(kind, rows):
+    """Turn raw rows into column mappings; returns ``(mappings, errors)``."""
+    fields = REFERENCES.get(kind, ())
+    usernames = {str(row.get(field, '')).strip() for _, row in rows if isinstance(row, dict) for field in fields}
+    users = lookup_users(usernames) if usernames else {}
+    mappings, errors = [], []
+    for position, row in rows:
+        try:
+            if not isinstance(row, dict):
+                raise RowError('expected an object with named fields')
+            mappings.append(CONVERTERS[kind](row, users))
+        except RowError as e:
+            errors.append(f'{position}: {e}')
+    return mappings, errors
+
+
+def existing_values(column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), 500):
+        found.update(value for value, in db.session.query(column).filter(column.in_(values[i:i + 500])))
+    return found
+
+
+def validate(kind, path, skip, batch_size):
+    """Check every row that has not been imported yet before anything is written."""
+    errors, count = [], 0
+    seen = {'username': set(), 'email': set()}
+    for batch in batches(islice(read_rows(path), skip, None), batch_size):
+        mappings, batch_errors = convert_batch(kind, batch)
+        errors.extend(batch_errors)
+        count += len(batch)
+        if kind in ('users', 'restaurants'):
+            for field, column in (('username', User.username), ('email', User.email)):
+                values = [m[field] for m in mappings]
+                for value in existing_values(column, values):
+                    errors.append(f'{field} {value!r} is already registered')
+                for value in values:
+                    if value in seen[field]:
+                        errors.append(f'{field} {value!r} appears more than once')
+                    seen[field].add(value)
+        if len(errors) > 50:
+            break
+    return count, errors
+
+
+def _score_chunk(texts):
+    # Runs in a worker process
+    return sentiment_engine.score_many(texts)
+
+
+class Importer:
+    def __init__(self, batch_size, workers, score=True):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.score = score
+        self._scorer = None
+        self._hasher = None
+
+    def close(self):
+        for executor in (self._scorer, self._hasher):
+            if executor is not None:
+                executor.shutdown()
+
+    def scores(self, texts):
+        if self._scorer is None:
+            # Load the models before forking so every worker starts with them
+            warm_up()
+            self._scorer = ProcessPoolExecutor(max_workers=self.workers)
+        size = max(len(texts) // self.workers, 1)
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        return [score for chunk in self._scorer.map(_score_chunk, chunks) for score in chunk]
+
+    def hash_passwords(self, passwords):
+        # bcrypt releases the GIL, so threads hash on every core
+        if self._hasher is None:
+            self._hasher = ThreadPoolExecutor(max_workers=self.workers)
+        rounds = app.config['BCRYPT_LOG_ROUNDS']
+        return list(self._hasher.map(lambda p: bcrypt.generate_password_hash(p, rounds).decode('utf-8'), passwords))
+
+    def insert_users(self, mappings):
+        plain = [m for m in mappings if 'plain_password' in m]
+        for m, hashed in zip(plain, self.hash_passwords([m.pop('plain_password') for m in plain])):
+            m['password'] = hashed
+        tables = [m.pop('tables', None) for m in mappings]
+        db.session.bulk_insert_mappings(User, mappings, return_defaults=True)
+        restaurants = [(m['id'], total) for m, total in zip(mappings, tables) if total]
+        if restaurants:
+            db.session.bulk_insert_mappings(Tables, [{'rest_id': rest_id, 'total': total, 'available': total}
+                                                     for rest_id, total in restaurants])
+        # New users are on no cached page yet
+        return {rest_id for rest_id, _ in restaurants}, set()
+
+    def insert_posts(self, mappings):
+        db.session.bulk_insert_mappings(Post, mappings, return_defaults=True)
+        search.index_objects(Post(**m) for m in mappings)
+        rest_ids = {m['rest_id'] for m in mappings}
+        return rest_ids, {'posts'} | {f'posts:{rest_id}' for rest_id in rest_ids}
+
+    def insert_media(self, mappings):
+        db.session.bulk_insert_mappings(Media, mappings)
+        return set(), {f"medias:{m['rest_id']}" for m in mappings}
+
+    def insert_reviews(self, mappings):
+        if self.score:
+            for m, score in zip(mappings, self.scores([m['content'] for m in mappings])):
+                m['sentiment'] = score
+        db.session.bulk_insert_mappings(Review, mappings, return_defaults=True)
+        if self.score:
+            aggregates.apply_scores(db.session, [(m['rest_id'], m['date_posted'].date(), m['sentiment'])
+                                                 for m in mappings])
+        else:
+            db.session.bulk_insert_mappings(ScoringJob, [{'review_id': m['id'], 'status': 'pending', 'attempts': 0}
+                                                         for m in mappings])
+        search.index_objects(Review(**m) for m in mappings)
+        rest_ids = {m['rest_id'] for m in mappings}
+        return rest_ids, {f'reviews:{rest_id}' for rest_id in rest_ids}
+
+    def insert_batch(self, kind, mappings):
+        # Bulk inserts skip the session hooks that keep the search index, review stats,
+        # restaurant ranking and page cache current, so they are updated here instead.
+        insert = {'users': self.insert_users, 'restaurants': self.insert_users, 'posts': self.insert_posts,
+                  'media': self.insert_media, 'reviews': self.insert_reviews}[kind]
+        rest_ids, tags = insert(mappings)
+        if rest_ids:
+            slot = leaderboard.next_slot()
+            for rest_id in rest_ids:
+                leaderboard.refresh(db.session, rest_id, slot)
+        return tags
+
+    def run(self, kind, path, echo=click.echo):
+        key = source_key(kind, path)
+        progress = ImportProgress.query.get(key)
+        done = progress.rows_done if progress else 0
+        if done:
+            echo(f'{kind}: resuming after {done} row(s) already imported from {path}')
+        total, errors = validate(kind, path, done, self.batch_size)
+        if errors:
+            raise ImportFailed(f'{path} has invalid rows; nothing was imported from it:\n' + '\n'.join(errors[:50]))
+        if not total:
+            echo(f'{kind}: nothing to import from {path}')
+            return 0
+
+        start = time.perf_counter()
+        imported = 0
+        for batch in batches(islice(read_rows(path), done, None), self.batch_size):
+            mappings, errors = convert_batch(kind, batch)
+            if errors:
+                raise ImportFailed('\n'.join(errors))
+            try:
+                tags = self.insert_batch(kind, mappings)
+                done += len(batch)
+                progress = progress or ImportProgress(source=key)
+                progress.rows_done = done
+                db.session.add(progress)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            invalidate(*tags)
+            imported += len(batch)
+            elapsed = time.perf_counter() - start
+            echo(f'{kind}: {imported}/{total} rows ({imported / elapsed:.0f} rows/s)')
+        return imported
+
+
+@app.cli.command('import-data')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--batch-size', type=int, default=lambda: app.config['IMPORT_BATCH_SIZE'], show_default='1000',
+              help='Rows inserted per transaction.')
+@click.option('--workers', type=int, default=lambda: os.cpu_count() or 1,
+              help='Processes for sentiment scoring and threads for password hashing.')
+@click.option('--no-score', is_flag=True, help='Queue reviews for `flask score-reviews` instead of scoring them now.')
+@click.option('--dry-run', is_flag=True, help='Only validate the files.')
+def import_data_command(source, batch_size, workers, no_score, dry_run):
+    """Import users, restaurants, posts, media and reviews from CSV or JSON.
+
+    SOURCE is a file named after what it holds (users, restaurants, posts, media or reviews,
+    with a .csv, .json, .ndjson or .jsonl extension) or a directory of such files, which are
+    imported in that order. Each batch commits together with the import's progress, so
+    running the same command again after a failure carries on where it stopped.
+    """
+    importer = Importer(batch_size, workers, score=not no_score)
+    try:
+        sources = find_sources(source)
+        if not sources:
+            raise ImportFailed(f'No importable files in {source}')
+        for kind, path in sources:
+            if dry_run:
+                progress = ImportProgress.query.get(source_key(kind, path))
+                total, errors = validate(kind, path, progress.rows_done if progress else 0, batch_size)
+                if errors:
+                    raise ImportFailed(f'{path} has invalid rows:\n' + '\n'.join(errors[:50]))
+                click.echo(f'{kind}: {total} row(s) to import from {path}')
+                continue
+            start = time.perf_counter()
+            imported = importer.run(kind, path)
+            if imported:
+                elapsed = time.perf_counter() - start
+                click.echo(f'{kind}: imported {imported} row(s) in {elapsed:.1f}s ({imported / elapsed:.0f} rows/s)')
+    except ImportFailed as e:
+        raise click.ClickException(str(e))
+    except LookupError as e:
+        raise click.ClickException(f'{e}\nOr import with --no-score and run `flask score-reviews` later.')
+    finally:
+        importer.close()
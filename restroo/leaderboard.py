@@ -0,0 +1,150 @@
+from datetime import datetime
+
+import click
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import joinedload
+
+from restroo import app, db
+from restroo.aggregates import update_review_aggregates
+from restroo.booking import upcoming_slots
+from restroo.models import Booking, Post, RestaurantRank, Review, ReviewAggregate, SlotOccupancy, Tables, User
+from restroo.pagination import paginate
+
+SORTS = {
+    'rating': RestaurantRank.avg_sentiment,
+    'reviews': RestaurantRank.review_count,
+    'recent': RestaurantRank.last_activity,
+    'available': RestaurantRank.available,
+}
+
+_availability_slot = None
+
+
+def next_slot(now=None):
+    return next(upcoming_slots(2, now), None)
+
+
+def _affected(obj):
+    if isinstance(obj, (Review, Post, Booking, Tables)):
+        return obj.rest_id
+    if isinstance(obj, User):
+        return obj.id
+    return None
+
+
+def refresh(session, rest_id, slot=None):
+    """Recompute one restaurant's leaderboard row inside the current transaction.
+
+    Each value comes from a single indexed lookup: the review aggregate, the newest post and
+    review through their (rest_id, date_posted) indexes, and the occupancy of the next slot.
+    """
+    rank = RestaurantRank.__table__
+    role = session.execute(select([User.role]).where(User.id == rest_id)).scalar()
+    if role != 'restaurant':
+        session.execute(rank.delete().where(rank.c.rest_id == rest_id))
+        return
+    slot = slot or next_slot()
+    aggregate = session.execute(select([ReviewAggregate.review_count, ReviewAggregate.sentiment_sum])
+                                .where(ReviewAggregate.rest_id == rest_id)).first()
+    count, total = aggregate or (0, 0.0)
+    latest = [session.execute(select([db.func.max(model.date_posted)]).where(model.rest_id == rest_id)).scalar()
+              for model in (Post, Review)]
+    latest = [value for value in latest if value is not None]
+    capacity = session.execute(select([db.func.sum(Tables.total)]).where(Tables.rest_id == rest_id)).scalar() or 0
+    booked = 0
+    if slot is not None:
+        booked = session.execute(select([SlotOccupancy.booked]).where(db.and_(
+            SlotOccupancy.rest_id == rest_id, SlotOccupancy.slot_start == slot))).scalar() or 0
+    values = {'review_count': count, 'avg_sentiment': total / count if count else None,
+              'last_activity': max(latest) if latest else None, 'capacity': capacity,
+              'available': max(capacity - booked, 0), 'slot_start': slot}
+    if not session.execute(rank.update().where(rank.c.rest_id == rest_id).values(values)).rowcount:
+        session.execute(rank.insert().values(dict(values, rest_id=rest_id)))
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_leaderboard(session, flush_context):
+    # The ranking is computed from the review aggregates, so they are brought up to date first
+    update_review_aggregates(session, flush_context)
+
+    # Bookings change occupancy through bulk UPDATEs, but always flush a Booking in the same
+    # transaction, so the restaurant still shows up here.
+    rest_ids = set()
+    for obj in list(session.new) + list(session.deleted):
+        rest_ids.add(_affected(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Review):
+            if inspect(obj).attrs.sentiment.history.has_changes():
+                rest_ids.add(obj.rest_id)
+        elif isinstance(obj, (User, Tables)) and session.is_modified(obj, include_collections=False):
+            rest_ids.add(_affected(obj))
+    rest_ids.discard(None)
+    if rest_ids:
+        slot = next_slot()
+        for rest_id in rest_ids:
+            refresh(session, rest_id, slot)
+
+
+def refresh_availability(now=None):
+    """Move every row's availability on to the next slot once the slot it describes starts.
+
+    A single UPDATE over the rows that are behind, so it is cheap to call on each request and
+    only does work once per slot boundary in each process.
+    """
+    global _availability_slot
+    slot = next_slot(now)
+    if slot is None or slot == _availability_slot:
+        return
+    rank = RestaurantRank.__table__
+    booked = select([SlotOccupancy.booked]).where(db.and_(SlotOccupancy.rest_id == rank.c.rest_id,
+                                                          SlotOccupancy.slot_start == slot)).as_scalar()
+    available = rank.c.capacity - db.func.coalesce(booked, 0)
+    db.session.execute(rank.update()
+                       .where(db.or_(rank.c.slot_start.is_(None), rank.c.slot_start < slot))
+                       .values(slot_start=slot,
+                               available=db.case([(available < 0, 0)], else_=available)))
+    db.session.commit()
+    _availability_slot = slot
+
+
+def directory(sort, args, per_page=20):
+    """Return one :class:`~restroo.pagination.Page` of the directory, best first."""
+    refresh_availability()
+    # Keyset pages walk the (column, rest_id) index backwards; restaurants without reviews or
+    # activity have NULLs there and are listed last
+    return paginate(RestaurantRank.query, RestaurantRank, args, None,
+                    options=(joinedload(RestaurantRank.restaurant),),
+                    order=(SORTS.get(sort, SORTS['rating']), RestaurantRank.rest_id), per_page=per_page)
+
+
+def rebuild(now=None):
+    slot = next_slot(now)
+    restaurants = [rest_id for rest_id, in db.session.query(User.id).filter(User.role == 'restaurant')]
+    aggregates = {rest_id: (count, total) for rest_id, count, total in db.session.query(
+        ReviewAggregate.rest_id, ReviewAggregate.review_count, ReviewAggregate.sentiment_sum)}
+    latest = {}
+    for model in (Post, Review):
+        for rest_id, value in db.session.query(model.rest_id, db.func.max(model.date_posted)).group_by(model.rest_id):
+            latest[rest_id] = max(value, latest.get(rest_id, value))
+    capacity = dict(db.session.query(Tables.rest_id, db.func.sum(Tables.total)).group_by(Tables.rest_id))
+    booked = dict(db.session.query(SlotOccupancy.rest_id, SlotOccupancy.booked)
+                  .filter(SlotOccupancy.slot_start == slot)) if slot else {}
+
+    RestaurantRank.query.delete(synchronize_session=False)
+    rows = []
+    for rest_id in restaurants:
+        count, total = aggregates.get(rest_id, (0, 0.0))
+        tables = capacity.get(rest_id) or 0
+        rows.append({'rest_id': rest_id, 'review_count': count, 'avg_sentiment': total / count if count else None,
+                     'last_activity': latest.get(rest_id), 'capacity': tables,
+                     'available': max(tables - booked.get(rest_id, 0), 0), 'slot_start': slot})
+    if rows:
+        db.session.execute(RestaurantRank.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+@app.cli.command('rebuild-leaderboard')
+def rebuild_leaderboard_command():
+    """Recompute the restaurant directory ranking from scratch."""
+    click.echo(f'Ranked {rebuild(datetime.now())} restaurant(s)')
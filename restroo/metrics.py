@@ -0,0 +1,246 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from restroo import app
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REGISTRY = []
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: self._copy(value) for labels, value in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _label_text(self, labels, extra=()):
+        pairs = list(zip(self.labels, labels)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{self._label_text(labels)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        # One slot per bucket plus +Inf, then the sum; made cumulative only when rendered
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def samples(self, values):
+        for labels, series in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                yield f'{self.name}_bucket{self._label_text(labels, [("le", bound)])} {total}'
+            yield f'{self.name}_sum{self._label_text(labels)} {series[-1]}'
+            yield f'{self.name}_count{self._label_text(labels)} {total}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextmanager
+def timed(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+request_seconds = Histogram('restroo_http_request_duration_seconds', 'Time to build each response.',
+                            ('endpoint', 'method', 'status'))
+request_queries = Histogram('restroo_http_request_queries', 'SQL statements run per request.', ('endpoint',),
+                            buckets=COUNT_BUCKETS)
+sql_seconds = Histogram('restroo_sql_duration_seconds', 'SQL statement execution time.', ('statement',),
+                        buckets=SQL_BUCKETS)
+template_seconds = Histogram('restroo_template_render_seconds', 'Jinja template render time.', ('template',))
+sentiment_seconds = Histogram('restroo_sentiment_seconds', 'VADER scoring time for uncached review texts.',
+                              buckets=SQL_BUCKETS)
+image_seconds = Histogram('restroo_image_render_seconds', 'Time to write the renditions of an upload.', ('folder',))
+image_failures = Counter('restroo_image_render_failures_total', 'Uploads whose renditions could not be written.',
+                         ('folder',))
+booking_conflicts = Counter('restroo_booking_conflicts_total', 'Bookings refused because a slot was full or locked.',
+                            ('reason',))
+
+
+def statement_kind(statement):
+    word = statement.lstrip()[:6].lower()
+    return word if word in ('select', 'insert', 'update', 'delete') else 'other'
+
+
+def observe_sql(statement, elapsed):
+    # Called by querystats, which times every statement
+    sql_seconds.observe(elapsed, statement_kind(statement))
+    if has_request_context():
+        g.metrics_queries = g.get('metrics_queries', 0) + 1
+
+
+class TimedTemplate(app.jinja_env.template_class):
+    def render(self, *args, **kwargs):
+        if not app.config['METRICS']:
+            return super().render(*args, **kwargs)
+        with timed(template_seconds, self.name or '<string>'):
+            return super().render(*args, **kwargs)
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@app.before_request
+def start_request_timer():
+    if app.config['METRICS']:
+        g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    request_seconds.observe(time.perf_counter() - start, endpoint, request.method, response.status_code)
+    request_queries.observe(g.pop('metrics_queries', 0), endpoint)
+    if app.config['METRICS_DIR']:
+        start_flusher()
+    return response
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+# With several worker processes each one saves its values to METRICS_DIR from a background
+# thread, and whichever worker answers /metrics adds them all up.
+def start_flusher():
+    global _flusher
+    with _flusher_lock:
+        # Threads do not survive fork, so each worker starts its own on its first request
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_forever, name='restroo-metrics', daemon=True)
+            _flusher.start()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(app.config['METRICS_FLUSH_INTERVAL'])
+        write_snapshot()
+
+
+def write_snapshot():
+    # JSON rather than pickle: loading a pickle runs whatever code it names, and anyone able to
+    # write to METRICS_DIR would get to run it in the worker answering /metrics
+    directory = app.config['METRICS_DIR']
+    os.makedirs(directory, exist_ok=True)
+    values = {name: [[list(labels), value] for labels, value in series.items()]
+              for name, series in snapshot().items()}
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(values, f)
+    os.replace(tmp, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+def collect():
+    if not app.config['METRICS_DIR']:
+        return snapshot()
+    write_snapshot()
+    totals = {metric.name: {} for metric in REGISTRY}
+    merge = {metric.name: metric.merge for metric in REGISTRY}
+    for entry in os.scandir(app.config['METRICS_DIR']):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                values = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in values.items():
+            if name not in totals:
+                continue
+            for labels, value in series:
+                labels = tuple(labels)
+                current = totals[name].get(labels)
+                totals[name][labels] = value if current is None else merge[name](current, value)
+    return totals
+
+
+def render():
+    values = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples(values[metric.name]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,245 @@
+import click
+from sqlalchemy import (Column, Date, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+                        UniqueConstraint, inspect)
+
+from restroo import aggregates, app, booking, db, leaderboard, search
+from restroo.models import SchemaMigration
+
+# Applied in order and recorded in the schema_migration table. Append new steps; never edit
+# or reorder ones that may already have run somewhere.
+MIGRATIONS = []
+
+# Frozen copies of the tables as the migration that creates each one left it. Later changes
+# are made with explicit steps below, never by editing these, so replaying the migrations
+# always builds the same schema whatever the models currently say.
+schema = MetaData()
+
+user = Table('user', schema,
+             Column('id', Integer, primary_key=True),
+             Column('name', String(100), nullable=False),
+             Column('username', String(20), nullable=False, unique=True),
+             Column('email', String(120), nullable=False, unique=True),
+             Column('address', Text, nullable=False),
+             Column('contact', Integer, nullable=False),
+             Column('role', String(20), nullable=False),
+             Column('image_file', String(20), nullable=False),
+             Column('password', String(60), nullable=False))
+post = Table('post', schema,
+             Column('id', Integer, primary_key=True),
+             Column('title', String(100), nullable=False),
+             Column('date_posted', DateTime, nullable=False),
+             Column('content', Text, nullable=False),
+             Column('category', String(20), nullable=False),
+             Column('rest_id', Integer, ForeignKey('user.id'), nullable=False))
+tables = Table('tables', schema,
+               Column('id', Integer, primary_key=True),
+               Column('total', Integer, nullable=False),
+               Column('available', Integer, nullable=False),
+               Column('rest_id', Integer, ForeignKey('user.id'), nullable=False))
+media = Table('media', schema,
+              Column('id', Integer, primary_key=True),
+              Column('title', String(100), nullable=False),
+              Column('date_posted', DateTime, nullable=False),
+              Column('image_file', String(20), nullable=False),
+              Column('content', String(500), nullable=False),
+              Column('rest_id', Integer, ForeignKey('user.id'), nullable=False))
+booking_table = Table('booking', schema,
+                      Column('id', Integer, primary_key=True),
+                      Column('date_posted', DateTime, nullable=False),
+                      Column('number_of_table', Integer, nullable=False),
+                      Column('cust_id', Integer, ForeignKey('user.id'), nullable=False),
+                      Column('rest_id', Integer, ForeignKey('user.id'), nullable=False))
+review = Table('review', schema,
+               Column('id', Integer, primary_key=True),
+               Column('title', String(100), nullable=False),
+               Column('date_posted', DateTime, nullable=False),
+               Column('content', Text, nullable=False),
+               Column('sentiment', String(120)),
+               Column('rest_id', Integer, ForeignKey('user.id'), nullable=False),
+               Column('cust_id', Integer, ForeignKey('user.id'), nullable=False))
+BASELINE = [user, post, tables, media, booking_table, review]
+
+scoring_job = Table('scoring_job', schema,
+                    Column('id', Integer, primary_key=True),
+                    Column('review_id', Integer, ForeignKey('review.id'), nullable=False, unique=True),
+                    Column('status', String(20), nullable=False),
+                    Column('attempts', Integer, nullable=False),
+                    Column('error', Text),
+                    Column('updated', DateTime, nullable=False),
+                    Index('ix_scoring_job_status', 'status'))
+slot_occupancy = Table('slot_occupancy', schema,
+                       Column('id', Integer, primary_key=True),
+                       Column('rest_id', Integer, ForeignKey('user.id'), nullable=False),
+                       Column('slot_start', DateTime, nullable=False),
+                       Column('booked', Integer, nullable=False),
+                       UniqueConstraint('rest_id', 'slot_start'))
+search_term = Table('search_term', schema,
+                    Column('id', Integer, primary_key=True),
+                    Column('term', String(64), nullable=False),
+                    Column('doc_id', Integer, nullable=False),
+                    Column('rest_id', Integer, nullable=False),
+                    Column('category', String(20)),
+                    Column('weight', Integer, nullable=False),
+                    Index('ix_search_term_term_doc_id', 'term', 'doc_id'),
+                    Index('ix_search_term_doc_id', 'doc_id'))
+review_aggregate = Table('review_aggregate', schema,
+                         Column('rest_id', Integer, ForeignKey('user.id'), primary_key=True),
+                         Column('review_count', Integer, nullable=False),
+                         Column('sentiment_sum', Float, nullable=False))
+review_histogram = Table('review_histogram', schema,
+                         Column('rest_id', Integer, ForeignKey('user.id'), primary_key=True),
+                         Column('bucket', Integer, primary_key=True),
+                         Column('review_count', Integer, nullable=False))
+review_daily = Table('review_daily', schema,
+                     Column('rest_id', Integer, ForeignKey('user.id'), primary_key=True),
+                     Column('day', Date, primary_key=True),
+                     Column('review_count', Integer, nullable=False),
+                     Column('sentiment_sum', Float, nullable=False))
+restaurant_rank = Table('restaurant_rank', schema,
+                        Column('rest_id', Integer, ForeignKey('user.id'), primary_key=True),
+                        Column('review_count', Integer, nullable=False),
+                        Column('avg_sentiment', Float),
+                        Column('last_activity', DateTime),
+                        Column('capacity', Integer, nullable=False),
+                        Column('available', Integer, nullable=False),
+                        Column('slot_start', DateTime),
+                        Index('ix_restaurant_rank_avg_sentiment', 'avg_sentiment', 'rest_id'),
+                        Index('ix_restaurant_rank_review_count', 'review_count', 'rest_id'),
+                        Index('ix_restaurant_rank_last_activity', 'last_activity', 'rest_id'),
+                        Index('ix_restaurant_rank_available', 'available', 'rest_id'))
+
+import_progress = Table('import_progress', schema,
+                        Column('source', String(80), primary_key=True),
+                        Column('rows_done', Integer, nullable=False),
+                        Column('updated', DateTime, nullable=False))
+
+
+def migration(name):
+    def decorator(f):
+        MIGRATIONS.append((name, f))
+        return f
+    return decorator
+
+
+# Each step checks the live schema first. Databases created before migrations existed may
+# already have some of these tables from db.create_all().
+def create_tables(conn, *frozen):
+    schema.create_all(conn, tables=frozen, checkfirst=True)
+
+
+def add_column(conn, table, column):
+    # Only nullable columns, so existing rows need no value
+    if column.name not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        conn.execute(f'ALTER TABLE {conn.dialect.identifier_preparer.quote(table)} '
+                     f'ADD COLUMN {column.name} {column.type.compile(conn.dialect)}')
+
+
+def add_index(conn, table, name, *columns):
+    if name not in {index['name'] for index in inspect(conn).get_indexes(table)}:
+        conn.execute(f'CREATE INDEX {name} ON {conn.dialect.identifier_preparer.quote(table)} '
+                     f'({", ".join(columns)})')
+
+
+def alter_column_type(conn, table, column):
+    if conn.dialect.name == 'sqlite':
+        # SQLite does not enforce VARCHAR lengths and cannot alter a column in place
+        return
+    table = conn.dialect.identifier_preparer.quote(table)
+    ddl = column.type.compile(conn.dialect)
+    if conn.dialect.name == 'mysql':
+        conn.execute(f'ALTER TABLE {table} MODIFY {column.name} {ddl}{"" if column.nullable else " NOT NULL"}')
+    else:
+        conn.execute(f'ALTER TABLE {table} ALTER COLUMN {column.name} TYPE {ddl}')
+
+
+@migration('0001_slots_search_stats_and_indexes')
+def add_tables_and_indexes():
+    # The original tables on a new database, then feed and per-restaurant indexes,
+    # booking.slot_start, slot occupancy, scoring jobs, search terms, review aggregates and
+    # the restaurant ranking. One transaction, so a failure leaves the schema untouched.
+    with db.engine.begin() as conn:
+        create_tables(conn, *BASELINE)
+        add_column(conn, 'booking', Column('slot_start', DateTime))
+        add_index(conn, 'post', 'ix_post_date_posted', 'date_posted')
+        for table in ('post', 'media', 'booking', 'review'):
+            add_index(conn, table, f'ix_{table}_rest_id_date_posted', 'rest_id', 'date_posted')
+        add_index(conn, 'tables', 'ix_tables_rest_id', 'rest_id')
+        create_tables(conn, scoring_job, slot_occupancy, search_term, review_aggregate, review_histogram,
+                      review_daily, restaurant_rank)
+
+
+@migration('0002_backfill_slot_occupancy')
+def backfill_slot_occupancy():
+    booking.rebuild_occupancy()
+
+
+@migration('0003_backfill_search_index')
+def backfill_search_index():
+    search.rebuild()
+
+
+@migration('0004_backfill_review_stats')
+def backfill_review_stats():
+    aggregates.rebuild()
+
+
+@migration('0005_backfill_leaderboard')
+def backfill_leaderboard():
+    leaderboard.rebuild()
+
+
+@migration('0006_import_progress')
+def add_import_progress():
+    with db.engine.begin() as conn:
+        create_tables(conn, import_progress)
+
+
+@migration('0007_scoring_job_claim')
+def add_scoring_job_claim():
+    with db.engine.begin() as conn:
+        add_column(conn, 'scoring_job', Column('claim', String(32)))
+
+
+@migration('0008_widen_image_file')
+def widen_image_file():
+    # Content-addressed upload names are 36 characters
+    with db.engine.begin() as conn:
+        for table in ('user', 'media'):
+            alter_column_type(conn, table, Column('image_file', String(40), nullable=False))
+
+
+def applied_migrations():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    return {name for name, in db.session.query(SchemaMigration.name)}
+
+
+def pending_migrations():
+    applied = applied_migrations()
+    return [(name, f) for name, f in MIGRATIONS if name not in applied]
+
+
+def upgrade():
+    done = []
+    for name, f in pending_migrations():
+        f()
+        db.session.add(SchemaMigration(name=name))
+        db.session.commit()
+        done.append(name)
+    return done
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create or update the database schema and backfill derived tables."""
+    done = upgrade()
+    for name in done:
+        click.echo(f'Applied {name}')
+    click.echo(f'{len(done)} migration(s) applied' if done else 'Database is up to date')
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List migrations and whether each has been applied."""
+    applied = applied_migrations()
+    for name, _ in MIGRATIONS:
+        click.echo(f"{'applied' if name in applied else 'pending'}  {name}")
@@ -1,13 +1,8 @@
 from datetime import datetime
-from restroo import db, login_manager
+from restroo import db
 from flask_login import UserMixin
 
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -16,7 +11,7 @@ class User(db.Model, UserMixin):
     address = db.Column(db.Text, nullable=False)
     contact = db.Column(db.Integer, nullable=False)
     role = db.Column(db.String(20), nullable=False, default="customer")
-    image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
+    image_file = db.Column(db.String(40), nullable=False, default='default.jpg')
     password = db.Column(db.String(60), nullable=False)
     # Relationships
     table = db.relationship('Tables', backref='restaurant', lazy=True)
@@ -36,9 +31,10 @@ class User(db.Model, UserMixin):
 
 
 class Post(db.Model):
+    __table_args__ = (db.Index('ix_post_rest_id_date_posted', 'rest_id', 'date_posted'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
-    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     content = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(20), nullable=False)
     rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -53,17 +49,18 @@ class Tables(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     total = db.Column(db.Integer, nullable=False)
     available = db.Column(db.Integer, nullable=False)
-    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f"'{self.available}','{self.total}','{self.rest_id}','{self.id}'"
 
 
 class Media(db.Model):
+    __table_args__ = (db.Index('ix_media_rest_id_date_posted', 'rest_id', 'date_posted'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
+    image_file = db.Column(db.String(40), nullable=False, default='default.jpg')
     content = db.Column(db.String(500), nullable=False)
     rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
@@ -72,9 +69,12 @@ class Media(db.Model):
 
 
 class Booking(db.Model):
+    __table_args__ = (db.Index('ix_booking_rest_id_date_posted', 'rest_id', 'date_posted'),)
     id = db.Column(db.Integer, primary_key=True)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     number_of_table = db.Column(db.Integer, nullable=False)
+    # Start of the reserved time slot; NULL for bookings made before slots existed
+    slot_start = db.Column(db.DateTime)
     cust_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     # Relationships
@@ -85,17 +85,138 @@ class Booking(db.Model):
         return f"Booking('{self.number_of_table}', '{self.date_posted}')"
 
 
+class SlotOccupancy(db.Model):
+    __table_args__ = (db.UniqueConstraint('rest_id', 'slot_start'),)
+    id = db.Column(db.Integer, primary_key=True)
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    slot_start = db.Column(db.DateTime, nullable=False)
+    booked = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"SlotOccupancy('{self.rest_id}', '{self.slot_start}', '{self.booked}')"
+
+
 class Review(db.Model):
+    __table_args__ = (db.Index('ix_review_rest_id_date_posted', 'rest_id', 'date_posted'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
-    sentiment = db.Column(db.String(120), nullable="False")
+    # active_history keeps the old score available to the review aggregates even when it was never loaded
+    sentiment = db.column_property(db.Column(db.String(120), nullable="False"), active_history=True)
     rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     cust_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
     reviewer = db.relationship('User', back_populates='reviewed_by', foreign_keys='Review.cust_id')
     reviewplace = db.relationship('User', back_populates='reviewed_at', foreign_keys='Review.rest_id')
+    scoring_job = db.relationship('ScoringJob', back_populates='review', uselist=False,
+                                  cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f"Review('{self.title}', '{self.date_posted}')"
+
+
+class ReviewAggregate(db.Model):
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    sentiment_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def mean(self):
+        return self.sentiment_sum / self.review_count if self.review_count else None
+
+    def __repr__(self):
+        return f"ReviewAggregate('{self.rest_id}', '{self.review_count}', '{self.mean}')"
+
+
+class ReviewHistogram(db.Model):
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"ReviewHistogram('{self.rest_id}', '{self.bucket}', '{self.review_count}')"
+
+
+class ReviewDaily(db.Model):
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    sentiment_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def mean(self):
+        return self.sentiment_sum / self.review_count if self.review_count else None
+
+    def __repr__(self):
+        return f"ReviewDaily('{self.rest_id}', '{self.day}', '{self.review_count}')"
+
+
+class RestaurantRank(db.Model):
+    # One precomputed row per restaurant, refreshed when its reviews, posts or bookings change
+    __table_args__ = (db.Index('ix_restaurant_rank_avg_sentiment', 'avg_sentiment', 'rest_id'),
+                      db.Index('ix_restaurant_rank_review_count', 'review_count', 'rest_id'),
+                      db.Index('ix_restaurant_rank_last_activity', 'last_activity', 'rest_id'),
+                      db.Index('ix_restaurant_rank_available', 'available', 'rest_id'))
+    rest_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    avg_sentiment = db.Column(db.Float)
+    last_activity = db.Column(db.DateTime)
+    capacity = db.Column(db.Integer, nullable=False, default=0)
+    # Free tables in the slot starting at slot_start, the next bookable slot when the row was refreshed
+    available = db.Column(db.Integer, nullable=False, default=0)
+    slot_start = db.Column(db.DateTime)
+    # Relationships
+    restaurant = db.relationship('User')
+
+    def __repr__(self):
+        return f"RestaurantRank('{self.rest_id}', '{self.avg_sentiment}', '{self.review_count}')"
+
+
+class ScoringJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    review_id = db.Column(db.Integer, db.ForeignKey('review.id'), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    # Token of the worker that claimed the job; cleared when the review is edited, so a result
+    # scored from the old content is never written
+    claim = db.Column(db.String(32))
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Relationships
+    review = db.relationship('Review', back_populates='scoring_job')
+
+    def __repr__(self):
+        return f"ScoringJob('{self.review_id}', '{self.status}', '{self.attempts}')"
+
+
+class SearchTerm(db.Model):
+    # Inverted index used for full-text search on databases without SQLite FTS5
+    __table_args__ = (db.Index('ix_search_term_term_doc_id', 'term', 'doc_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(64), nullable=False)
+    doc_id = db.Column(db.Integer, nullable=False, index=True)
+    rest_id = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(20))
+    weight = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"SearchTerm('{self.term}', '{self.doc_id}', '{self.weight}')"
+
+
+class ImportProgress(db.Model):
+    # Rows of an import file committed so far, keyed on the file's kind and content hash
+    source = db.Column(db.String(80), primary_key=True)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"ImportProgress('{self.source}', '{self.rows_done}')"
+
+
+class SchemaMigration(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    applied = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
-        return f"Review('{self.title}', '{self.date_posted}')"
\ No newline at end of file
+        return f"SchemaMigration('{self.name}', '{self.applied}')"
@@ -0,0 +1,164 @@
+import base64
+import math
+import threading
+import time
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import and_, or_
+
+from restroo import app
+
+
+class Page:
+    """One page of a feed ordered by a column and id descending, by default ``(date_posted, id)``.
+
+    Prev/next navigation always uses keyset cursors, so it never needs a total. ``total``
+    is an approximate, cached count that is only used for the page-number links.
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, page=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.page = page
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        if not self.total:
+            return 0
+        return int(math.ceil(self.total / float(self.per_page)))
+
+    def iter_pages(self, left_edge=1, left_current=1, right_current=2, right_edge=1):
+        current = self.page or 0
+        last = 0
+        for num in range(1, self.pages + 1):
+            if num <= left_edge or (current - left_current - 1 < num < current + right_current) \
+                    or num > self.pages - right_edge:
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+
+def encode_cursor(value, item_id):
+    raw = f"{'' if value is None else value.isoformat() if isinstance(value, datetime) else value}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, column):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, item_id = raw.rsplit('|', 1)
+        kind = column.type.python_type
+        if value == '':
+            value = None
+        elif kind is datetime:
+            value = datetime.fromisoformat(value)
+        else:
+            value = kind(value)
+        return value, int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        abort(404)
+
+
+def _after(column, id_column, value, item_id, nullable):
+    # Rows that come after the cursor in descending order, where NULLs sort last
+    if value is None:
+        return and_(column.is_(None), id_column < item_id)
+    after = or_(column < value, and_(column == value, id_column < item_id))
+    return or_(after, column.is_(None)) if nullable else after
+
+
+def _before(column, id_column, value, item_id, nullable):
+    if value is None:
+        return or_(column.isnot(None), and_(column.is_(None), id_column > item_id))
+    return or_(column > value, and_(column == value, id_column > item_id))
+
+
+class CountCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            return entry[0]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (total, now)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+count_cache = CountCache(app.config['FEED_COUNT_TTL'])
+
+
+def paginate(query, model, args, count_key, options=(), order=None, per_page=None):
+    """Return one :class:`Page` of ``query``, newest first.
+
+    ``order`` is the ``(column, id column)`` pair to sort on, descending, and defaults to the
+    model's ``(date_posted, id)``; a nullable column puts its NULLs last. Without a
+    ``count_key`` no total is counted and no page-number links are shown.
+    """
+    per_page = per_page or app.config['FEED_PER_PAGE']
+    column, id_column = order or (model.date_posted, model.id)
+    nullable = column.expression.nullable
+    total = None
+    if count_key is not None and app.config['FEED_PAGE_NUMBERS']:
+        total = count_cache.get(count_key, query)
+    query = query.options(*options)
+    descending = (column.desc().nullslast() if nullable else column.desc(), id_column.desc())
+    after, before = args.get('after'), args.get('before')
+    page = None
+
+    if before:
+        value, item_id = decode_cursor(before, column)
+        items = query.filter(_before(column, id_column, value, item_id, nullable)) \
+            .order_by(column.asc().nullsfirst() if nullable else column.asc(), id_column.asc()) \
+            .limit(per_page + 1).all()
+        has_prev = len(items) > per_page
+        items = items[:per_page][::-1]
+        has_next = True
+    elif after:
+        value, item_id = decode_cursor(after, column)
+        items = query.filter(_after(column, id_column, value, item_id, nullable)) \
+            .order_by(*descending).limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        has_prev = True
+    else:
+        page = args.get('page', 1, type=int)
+        if page < 1:
+            abort(404)
+        items = query.order_by(*descending).offset((page - 1) * per_page).limit(per_page + 1).all()
+        if page > 1 and not items:
+            abort(404)
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        has_prev = page > 1
+
+    def cursor(item):
+        return encode_cursor(getattr(item, column.key), getattr(item, id_column.key))
+
+    return Page(items, per_page,
+                next_cursor=cursor(items[-1]) if has_next and items else None,
+                prev_cursor=cursor(items[0]) if has_prev and items else None,
+                page=page, total=total)
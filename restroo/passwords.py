@@ -0,0 +1,82 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+
+from restroo import app, bcrypt
+
+
+class HashingBusy(Exception):
+    pass
+
+
+@contextmanager
+def hashing_slot():
+    """Hold one of the host's PASSWORD_HASH_SLOTS while hashing.
+
+    A slot is a lock file in PASSWORD_HASH_DIR, so the limit covers every worker process on
+    the host, however many threads each one runs, and the kernel frees the slots of a worker
+    that dies mid-hash. Raises HashingBusy when none frees up within PASSWORD_HASH_WAIT seconds.
+    """
+    directory = app.config['PASSWORD_HASH_DIR']
+    os.makedirs(directory, exist_ok=True)
+    deadline = time.monotonic() + app.config['PASSWORD_HASH_WAIT']
+    while True:
+        for i in range(app.config['PASSWORD_HASH_SLOTS']):
+            fd = os.open(os.path.join(directory, f'{i}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                yield
+            finally:
+                os.close(fd)
+            return
+        if time.monotonic() >= deadline:
+            raise HashingBusy('Too many sign-ins right now, please try again in a moment')
+        time.sleep(0.05)
+
+
+def _run(f, *args):
+    # bcrypt releases the GIL, so threads of the same worker hash on separate cores
+    with hashing_slot():
+        return f(*args)
+
+
+def hash_cost(pw_hash):
+    # Modular crypt format: $2b$<cost>$<salt and hash>
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _hash(password, rounds):
+    return bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+
+def _verify(pw_hash, password, rounds):
+    if not bcrypt.check_password_hash(pw_hash, password):
+        return False, None
+    cost = hash_cost(pw_hash)
+    if cost is not None and cost < rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+
+def hash_password(password):
+    return _run(_hash, password, app.config['BCRYPT_LOG_ROUNDS'])
+
+
+def verify_password(user, password):
+    """Check ``password`` against ``user``'s hash.
+
+    Hashes made with a lower work factor than BCRYPT_LOG_ROUNDS are replaced on success;
+    the caller commits. Raises HashingBusy when every hashing slot on the host stays taken.
+    """
+    ok, upgraded = _run(_verify, user.password, password, app.config['BCRYPT_LOG_ROUNDS'])
+    if upgraded:
+        user.password = upgraded
+    return ok
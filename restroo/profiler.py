@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+from restroo import app
+
+
+class Sampler:
+    """Samples the call stacks of registered threads every ``interval`` seconds.
+
+    One background thread serves every request being profiled, and sleeps while there are none.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._stacks[ident] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='restroo-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._stacks.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._stacks
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._stacks.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+
+def collapse(frame):
+    # Outermost call first, in the folded format read by flamegraph.pl and speedscope
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = None
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = Sampler(app.config['PROFILE_INTERVAL'])
+    return _sampler
+
+
+@app.before_request
+def start_profile():
+    if app.config['PROFILE_SLOW_REQUESTS']:
+        g.profile_start = time.perf_counter()
+        get_sampler().start(threading.get_ident())
+
+
+@app.after_request
+def skip_streamed_profile(response):
+    # A streamed response, such as a booking event stream or an export, is still being sent
+    # when the request ends, and its time is mostly spent waiting on the client
+    if response.is_streamed and g.pop('profile_start', None) is not None:
+        get_sampler().stop(threading.get_ident())
+    return response
+
+
+@app.teardown_request
+def dump_slow_profile(exc):
+    start = g.pop('profile_start', None)
+    if start is None:
+        return
+    stacks = get_sampler().stop(threading.get_ident())
+    elapsed = time.perf_counter() - start
+    if elapsed < app.config['PROFILE_SLOW_REQUESTS'] or not stacks:
+        return
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.utcnow():%Y%m%dT%H%M%S.%f}-{request.endpoint or 'unmatched'}-{elapsed * 1000:.0f}ms.txt"
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    app.logger.warning('%s %s took %.0f ms; profile written to %s', request.method, request.path, elapsed * 1000, path)
@@ -0,0 +1,87 @@
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from restroo import app, metrics
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.duration += elapsed
+        self.statements.append((statement, elapsed))
+
+
+def accounting_enabled():
+    return app.config['QUERY_ACCOUNTING'] or app.debug or app.testing
+
+
+def current_stats():
+    if 'query_stats' not in g:
+        g.query_stats = QueryStats()
+    return g.query_stats
+
+
+def query_budget(limit):
+    # Place directly under @app.route so the budget ends up on the registered view
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+# The one place statements are timed: the numbers feed both the per-request accounting and
+# the SQL metrics.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if app.config['METRICS'] or (has_request_context() and accounting_enabled()):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if app.config['METRICS']:
+        metrics.observe_sql(statement, elapsed)
+    if has_request_context() and accounting_enabled():
+        current_stats().record(statement, elapsed)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_timer(context):
+    # A failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+@app.after_request
+def check_query_budget(response):
+    if not accounting_enabled():
+        return response
+    stats = current_stats()
+    response.headers['X-Query-Count'] = str(stats.count)
+    response.headers['X-Query-Time'] = f'{stats.duration * 1000:.2f}ms'
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', app.config['QUERY_BUDGET'])
+    if budget is not None and stats.count > budget:
+        message = f'{request.endpoint} ran {stats.count} queries (budget {budget}):\n' + \
+                  '\n'.join(statement for statement, _ in stats.statements)
+        if app.testing:
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+    return response
@@ -1,28 +1,38 @@
-import nltk as nltk
-from flask import render_template, url_for, flash, redirect, request, abort
-from nltk.corpus import stopwords
-from nltk.sentiment import SentimentIntensityAnalyzer
+import hmac
+
+from flask import render_template, url_for, flash, redirect, request, abort, Response, stream_with_context
 from werkzeug.utils import secure_filename
 
-from restroo import app, db, bcrypt
+from restroo import app, db
+from restroo.aggregates import review_summary
+from restroo.booking import (reserve_tables, cancel_booking, availability, capacity, slots_event, BookingError,
+                             SLOT_FORMAT)
+from restroo.cache import cached_page, invalidate
+from restroo.events import broker, open_stream, close_stream, opening, stream
 from restroo.forms import RegistrationForm, LoginForm, UpdateAccountForm, PostForm, ReviewForm, BookingForm, MediaForm
+from restroo.export import export_query, export_filename, stream_rows, parse_date, ExportError, FORMATS
+from restroo.identity import forget_user
+from restroo.images import save_image, image_url
+from restroo.leaderboard import directory, SORTS
+from restroo.metrics import render as render_metrics, CONTENT_TYPE
 from restroo.models import User, Post, Review, Booking, Tables, Media
+from restroo.pagination import paginate
+from restroo.passwords import hash_password, verify_password, HashingBusy
+from restroo.querystats import query_budget
+from restroo.scoring import queue_review, dispatch
+from restroo.search import search as search_index
 from flask_login import login_user, current_user, logout_user, login_required
-import secrets
-import os
-from PIL import Image
-
-nltk.download('vader_lexicon')
-
-nltk.download('stopwords')
-set(stopwords.words('english'))
+from sqlalchemy.orm import joinedload
+from datetime import datetime
+from itertools import groupby
 
 
 @app.route("/")
 @app.route("/home")
+@query_budget(4)
+@cached_page(lambda: ['posts'])
 def home():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
+    posts = paginate(Post.query, Post, request.args, 'posts', options=(joinedload(Post.author),))
     return render_template('home.html', posts=posts)
 
 
@@ -37,7 +47,11 @@ def register():
         return redirect(url_for('home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        try:
+            hashed_password = hash_password(form.password.data)
+        except HashingBusy as e:
+            flash(str(e), 'danger')
+            return render_template('register.html', title='Register', form=form), 503
         print(form.table.data)
         user = User(name=form.name.data, username=form.username.data, address=form.address.data,
                     email=form.email.data, password=hashed_password, contact=form.contact.data, role=form.role.data)
@@ -60,8 +74,17 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        try:
+            valid = user is not None and verify_password(user, form.password.data)
+        except HashingBusy as e:
+            flash(str(e), 'danger')
+            return render_template('login.html', title='Login', form=form), 503
+        if valid:
+            # Saves the hash if verify_password upgraded it to the current work factor
+            db.session.commit()
             login_user(user, remember=form.remember.data)
+            # A new session never trusts identities cached before this login
+            forget_user(user.id)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('home'))
         else:
@@ -75,27 +98,13 @@ def logout():
     return redirect(url_for('home'))
 
 
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
-
-    output_size = (125, 125)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-
-    i.save(picture_path)
-    return picture_fn
-
-
 @app.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
+            picture_file = save_image(form.picture.data, 'profile_pics')
             current_user.image_file = picture_file
         current_user.name = form.name.data
         current_user.email = form.email.data
@@ -104,6 +113,7 @@ def account():
         current_user.address = form.address.data
         current_user.role = form.role.data
         db.session.commit()
+        forget_user(current_user.id)
         flash('Your data have been updated successfully', 'success')
         return redirect(url_for('account'))
     elif request.method == 'GET':
@@ -113,7 +123,7 @@ def account():
         form.contact.data = current_user.contact
         form.address.data = current_user.address
         form.role.data = current_user.role
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
+    image_file = image_url('profile_pics', current_user.image_file)
     return render_template('account.html', title='Account', image_file=image_file, form=form)
 
 
@@ -131,8 +141,10 @@ def new_post():
 
 
 @app.route("/post/<int:post_id>")
+@query_budget(3)
+@cached_page(lambda post_id: [f'post:{post_id}'])
 def post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(joinedload(Post.author)).get_or_404(post_id)
     return render_template('post.html', title=post.title, post=post)
 
 
@@ -169,11 +181,38 @@ def delete_post(post_id):
     return redirect(url_for('home'))
 
 
+def user_id(username):
+    return db.session.query(User.id).filter_by(username=username).scalar()
+
+
+@app.route("/search")
+@query_budget(5)
+def search():
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('kind') if request.args.get('kind') in ('post', 'review') else None
+    category = request.args.get('category') or None
+    rest_id = request.args.get('rest_id', type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search_index(q, kind=kind, category=category, rest_id=rest_id, page=page,
+                                     per_page=app.config['SEARCH_PER_PAGE'])
+    return render_template('search.html', title='Search', results=results, has_next=has_next, q=q, kind=kind,
+                           category=category, rest_id=rest_id, page=page, categories=PostForm.catt)
+
+
+@app.route("/restaurants")
+@query_budget(4)
+def restaurants():
+    sort = request.args.get('sort') if request.args.get('sort') in SORTS else 'rating'
+    ranks = directory(sort, request.args, app.config['DIRECTORY_PER_PAGE'])
+    return render_template('restaurants.html', title='Restaurants', ranks=ranks, sort=sort)
+
+
 @app.route("/user_post/<string:username>")
+@query_budget(5)
+@cached_page(lambda username: [f'posts:{user_id(username)}'])
 def user_posts(username):
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
+    posts = paginate(Post.query.filter_by(rest_id=user.id), Post, request.args, ('posts', user.id))
     return render_template('user_post.html', posts=posts, user=user)
 
 
@@ -181,41 +220,36 @@ def user_posts(username):
 @login_required
 def new_review(rest_id):
     form = ReviewForm()
-
-    def sentiment(text1):
-        stop_words = stopwords.words('english')
-        processed_doc1 = ' '.join([word for word in text1.split() if word not in stop_words])
-        sa = SentimentIntensityAnalyzer()
-        dd = sa.polarity_scores(text=processed_doc1)
-        compound = round((1 + dd['compound']) / 2, 2)
-
-        return compound
-
     if form.validate_on_submit():
-        text1 = form.content.data.lower()
-        compound = sentiment(text1)
         rest = User.query.filter_by(id=rest_id).first_or_404()
-        review = Review(title=form.title.data, content=form.content.data, sentiment=compound,
-                        reviewer=current_user, reviewplace=rest)
+        review = Review(title=form.title.data, content=form.content.data, reviewer=current_user, reviewplace=rest)
+        queue_review(review)
         db.session.add(review)
         db.session.commit()
+        dispatch(review)
         flash('Your Review have been Created!', 'success')
         return redirect(url_for('home'))
     return render_template('create_review.html', title='New Review', form=form, legend='New Review')
 
 
 @app.route("/reviews/<int:rest_id>")
+@query_budget(8)
+@cached_page(lambda rest_id: [f'reviews:{rest_id}'])
 def reviews(rest_id):
-    page = request.args.get('page', 1, type=int)
-    user = User.query.filter_by(id=rest_id).first_or_404()
-    reviews = Review.query.filter_by(reviewplace=user).order_by(Review.date_posted.desc()).paginate(page=page,
-                                                                                                    per_page=5)
-    return render_template('reviews.html', reviews=reviews, rest_id=rest_id)
+    User.query.filter_by(id=rest_id).first_or_404()
+    reviews = paginate(Review.query.filter_by(rest_id=rest_id), Review, request.args, ('reviews', rest_id),
+                       options=(joinedload(Review.reviewer),))
+    summary = None
+    if current_user.is_authenticated and current_user.role == 'restaurant' and current_user.id == rest_id:
+        summary = review_summary(rest_id)
+    return render_template('reviews.html', reviews=reviews, rest_id=rest_id, summary=summary)
 
 
 @app.route("/review/<int:review_id>")
+@query_budget(3)
+@cached_page(lambda review_id: [f'review:{review_id}'])
 def review(review_id):
-    review = Review.query.get_or_404(review_id)
+    review = Review.query.options(joinedload(Review.reviewer)).get_or_404(review_id)
     return render_template('review.html', title=review.title, review=review)
 
 
@@ -239,9 +273,14 @@ def update_review(review_id):
         abort(403)
     form = ReviewForm()
     if form.validate_on_submit():
+        rescore = review.content != form.content.data
         review.title = form.title.data
         review.content = form.content.data
+        if rescore:
+            queue_review(review)
         db.session.commit()
+        if rescore:
+            dispatch(review)
         flash('Your Review has been updated!', 'success')
         return redirect(url_for('review', review_id=review.id))
     elif request.method == 'GET':
@@ -251,11 +290,11 @@ def update_review(review_id):
 
 
 @app.route("/bookings/<int:rest_id>")
+@query_budget(4)
 @login_required
 def bookings(rest_id):
-    page = request.args.get('page', 1, type=int)
-    bookings = Booking.query.filter_by(rest_id=rest_id).order_by(Booking.date_posted.desc()).paginate(page=page,
-                                                                                                      per_page=5)
+    bookings = paginate(Booking.query.filter_by(rest_id=rest_id), Booking, request.args, ('bookings', rest_id),
+                        options=(joinedload(Booking.booker), joinedload(Booking.bookplace)))
     return render_template('bookings.html', bookings=bookings, rest_id=rest_id)
 
 
@@ -264,94 +303,111 @@ def bookings(rest_id):
 def new_booking(rest_id):
     form = BookingForm()
     rest = User.query.filter_by(id=rest_id).first_or_404()
-    available = rest.table[0]
-    string = str(available)
-    string = string.replace("'", "")
-    tables = [int(x) for x in string.split(",")]
+    slots = availability(rest_id)
+    if slots is None:
+        abort(404)
+    form.slot.choices = [(slot.strftime(SLOT_FORMAT), slot.strftime('%a %d %b, %H:%M'))
+                         for slot, available in slots if available > 0]
     if form.validate_on_submit():
-
-        if tables[0] >= tables[1]:
-            flash('No table available', 'error')
-            return redirect(url_for('home'))
-        elif int(form.number_of_table.data) > tables[0]:
-            flash('Number of tables you requested is not available', 'error')
+        try:
+            reserve_tables(current_user, rest, form.number_of_table.data,
+                           datetime.strptime(form.slot.data, SLOT_FORMAT))
+        except BookingError as e:
+            flash(str(e), 'error')
             return redirect(url_for('home'))
-        else:
-            booking = Booking(number_of_table=form.number_of_table.data, booker=current_user, bookplace=rest)
-            db.session.add(booking)
-            db.session.commit()
-            decrement_table(tables[3])
-            flash('Your table has been booked!', 'success')
-            return redirect(url_for('home'))
-    return render_template('new_booking.html', title='Bookings', form=form, legend='Bookings', available=tables[0])
-
-
-def decrement_table(id):
-    db.session.query(Tables).filter(Tables.id == id).update({Tables.available: Tables.available - 1},
-                                                            synchronize_session=False)
-    db.session.commit()
-
-
-def increment_table(id):
-    db.session.query(Tables).filter(Tables.id == id).update({Tables.available: Tables.available + 1},
-                                                            synchronize_session=False)
-    db.session.commit()
+        flash('Your table has been booked!', 'success')
+        return redirect(url_for('home'))
+    days = [(day, list(day_slots)) for day, day_slots in groupby(slots, key=lambda s: s[0].date())]
+    return render_template('new_booking.html', title='Bookings', form=form, legend='Bookings', days=days,
+                           rest_id=rest_id, slot_format=SLOT_FORMAT)
+
+
+@app.route("/bookings/<int:rest_id>/events")
+@query_budget(3)
+def booking_events(rest_id):
+    total = capacity(rest_id)
+    if total is None:
+        abort(404)
+    # Taken before reading occupancy, so nothing published in between is missed
+    cursor = broker.cursor(rest_id)
+    first = slots_event(availability(rest_id, total=total))
+    if not open_stream():
+        # A 503 would stop EventSource for good; send the current availability instead and let
+        # the browser reconnect after the retry delay
+        response = Response(opening(first), mimetype='text/event-stream')
+    else:
+        owner = current_user.is_authenticated and current_user.id == rest_id
+        response = Response(stream(rest_id, cursor, first, private=owner), mimetype='text/event-stream')
+        response.call_on_close(close_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route("/bookings/<int:book_id>/delete", methods=['POST'])
 @login_required
 def delete_bookings(book_id):
     bookings = Booking.query.get_or_404(book_id)
-    available = bookings.bookplace.table[0]
-    string = str(available)
-    string = string.replace("'", "")
-    tables = [int(x) for x in string.split(",")]
-    tid = tables[3]
-    print(tid)
     if bookings.bookplace != current_user:
         abort(403)
-    db.session.delete(bookings)
-    db.session.commit()
-    increment_table(tid)
+    try:
+        cancel_booking(bookings)
+    except BookingError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('home'))
     flash('The booking cancelled successfully!', 'success')
     return redirect(url_for('home'))
 
 
+@app.route("/<any(bookings, reviews):kind>/<int:rest_id>/export.<any(csv, ndjson):fmt>")
+@login_required
+def export(kind, rest_id, fmt):
+    if current_user.id != rest_id:
+        abort(403)
+    try:
+        since, until = parse_date(request.args.get('since')), parse_date(request.args.get('until'))
+    except ExportError as e:
+        abort(400, str(e))
+    query = export_query(kind, rest_id, since, until)
+    response = Response(stream_with_context(stream_rows(db.engine, query, fmt)), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename="{export_filename(kind, rest_id, fmt, since, until)}"'
+    return response
+
+
 @app.route("/user_medias/<int:id>")
+@query_budget(4)
+@cached_page(lambda id: [f'medias:{id}'])
 def user_medias(id):
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(id=id).first_or_404()
-    medias = Media.query.filter_by(rest_id=id).order_by(Media.date_posted.desc()).paginate(page=page, per_page=5)
+    medias = paginate(Media.query.filter_by(rest_id=id), Media, request.args, ('medias', id))
     return render_template('user_medias.html', medias=medias, user=user)
 
 
-def save_media(form_picture):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static/media_files', picture_fn)
-    output_size = (500, 500)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-    return picture_fn
-
-
 @app.route("/user_medias/new/<int:rest_id>", methods=['GET', 'POST'])
 @login_required
 def new_media(rest_id):
     form = MediaForm()
     if form.validate_on_submit():
-        if form.media.data:
-            file = request.files.get("media")
-            picture_file = save_media(file)
-            media = Media(title=form.title.data, image_file=picture_file, rest_id=rest_id, content=form.content.data)
-            db.session.add(media)
-            db.session.commit()
-            flash('Your Media have been Added!', 'success')
-        else:
-            flash('Your Media cannot be Added!', 'error')
+        files = [f for f in form.media.data if f and f.filename]
+        medias = [Media(title=form.title.data, image_file=save_image(f, 'media_files'), rest_id=rest_id,
+                        content=form.content.data) for f in files]
+        db.session.bulk_save_objects(medias)
+        db.session.commit()
+        # Bulk saves bypass the session events that invalidate cached pages
+        invalidate(f'medias:{rest_id}')
+        flash(f'{len(medias)} Media have been Added!', 'success')
         return redirect(url_for('home'))
     return render_template('create_media.html', title='New Media', form=form, legend='New Media')
 
 
+@app.route("/metrics")
+def metrics():
+    # Only scrapers holding the token know the endpoint exists
+    token = app.config['METRICS_TOKEN']
+    if not app.config['METRICS'] or not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        abort(404)
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,172 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+
+from restroo import app, db
+from restroo.models import Review, ScoringJob
+from restroo.sentiment import sentiment_engine
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['SCORING_WORKERS'],
+                                       thread_name_prefix='restroo-scoring')
+    return _executor
+
+
+def queue_review(review):
+    # Marks the review as pending; the caller commits the review and the job together. Dropping
+    # the claim discards the result of any run still scoring the previous content.
+    review.sentiment = None
+    if review.scoring_job is None:
+        review.scoring_job = ScoringJob()
+    review.scoring_job.status = 'pending'
+    review.scoring_job.attempts = 0
+    review.scoring_job.error = None
+    review.scoring_job.claim = None
+
+
+def dispatch(review):
+    if app.config['SCORING_MODE'] == 'thread':
+        get_executor().submit(_run_in_context, [review.id])
+
+
+def _run_in_context(review_ids):
+    with app.app_context():
+        try:
+            process_jobs(review_ids)
+        finally:
+            db.session.remove()
+
+
+def claimable():
+    stale = datetime.utcnow() - timedelta(seconds=app.config['SCORING_STALE_SECONDS'])
+    return db.and_(db.or_(ScoringJob.status.in_(('pending', 'failed')),
+                          db.and_(ScoringJob.status == 'running', ScoringJob.updated < stale)),
+                   ScoringJob.attempts < app.config['SCORING_MAX_ATTEMPTS'])
+
+
+def claim_jobs(review_ids):
+    """Atomically claim the scorable jobs of ``review_ids``; returns ``(token, {job id: (review id, content)})``."""
+    token = uuid.uuid4().hex
+    db.session.query(ScoringJob) \
+        .filter(ScoringJob.review_id.in_(review_ids), claimable()) \
+        .update({ScoringJob.status: 'running', ScoringJob.attempts: ScoringJob.attempts + 1,
+                 ScoringJob.claim: token, ScoringJob.updated: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    rows = db.session.query(ScoringJob.id, Review.id, Review.content) \
+        .join(Review, Review.id == ScoringJob.review_id) \
+        .filter(ScoringJob.claim == token)
+    claimed = {job_id: (review_id, content) for job_id, review_id, content in rows}
+    db.session.commit()
+    return token, claimed
+
+
+def _finish(job_id, token, values):
+    # Only succeeds while the claim is still ours, i.e. the review has not been edited since
+    return db.session.query(ScoringJob) \
+        .filter(ScoringJob.id == job_id, ScoringJob.claim == token) \
+        .update(dict(values, updated=datetime.utcnow()), synchronize_session=False)
+
+
+def _score_one(content):
+    try:
+        return sentiment_engine.score_many([content])[0]
+    except Exception as e:
+        return e
+
+
+def process_jobs(review_ids):
+    token, claimed = claim_jobs(review_ids)
+    if not claimed:
+        return 0
+    contents = [content for _, content in claimed.values()]
+    try:
+        scores = sentiment_engine.score_many(contents)
+    except Exception:
+        # Score the batch one review at a time, so only the reviews that fail are marked failed
+        scores = [_score_one(content) for content in contents]
+    done = 0
+    for (job_id, (review_id, _)), score in zip(claimed.items(), scores):
+        if isinstance(score, Exception):
+            _finish(job_id, token, {'status': 'failed', 'error': repr(score), 'claim': None})
+            app.logger.error('Scoring review %d failed', review_id, exc_info=score)
+        elif _finish(job_id, token, {'status': 'done', 'error': None, 'claim': None}):
+            # Set through the ORM so the aggregate and ranking hooks see the new score
+            review = Review.query.get(review_id)
+            if review is not None:
+                review.sentiment = score
+                done += 1
+    db.session.commit()
+    return done
+
+
+def unfinished_jobs(limit=None, after=None):
+    query = db.session.query(ScoringJob.review_id).filter(claimable()).order_by(ScoringJob.review_id)
+    if after is not None:
+        query = query.filter(ScoringJob.review_id > after)
+    if limit:
+        query = query.limit(limit)
+    return [review_id for review_id, in query]
+
+
+def drain(batch_size=100):
+    """Score every claimable job; returns the number scored.
+
+    Each pass walks the jobs in review order, so a batch that fails does not hold up the ones
+    after it. Failed jobs are tried again on the next pass until they run out of attempts.
+    """
+    processed = 0
+    while unfinished_jobs(1):
+        after = None
+        while True:
+            review_ids = unfinished_jobs(batch_size, after)
+            if not review_ids:
+                break
+            processed += process_jobs(review_ids)
+            after = review_ids[-1]
+    return processed
+
+
+def failed_jobs():
+    return ScoringJob.query.filter(ScoringJob.status == 'failed').count()
+
+
+def requeue_unfinished():
+    review_ids = unfinished_jobs()
+    size = app.config['SCORING_BATCH_SIZE']
+    for i in range(0, len(review_ids), size):
+        get_executor().submit(_run_in_context, review_ids[i:i + size])
+    return len(review_ids)
+
+
+# Every worker process runs this on its first request; the claims make sure each job is still
+# scored only once.
+@app.before_first_request
+def resume_scoring():
+    if app.config['SCORING_MODE'] == 'thread':
+        requeue_unfinished()
+
+
+@app.cli.command('score-reviews')
+@click.option('--batch-size', default=100, show_default=True)
+@click.option('--watch', is_flag=True, help='Keep polling for new jobs.')
+@click.option('--interval', default=2.0, show_default=True, help='Polling interval in seconds.')
+def score_reviews_command(batch_size, watch, interval):
+    """Score pending and failed reviews."""
+    while True:
+        processed = drain(batch_size)
+        if processed:
+            click.echo(f'Scored {processed} review(s)')
+        if not watch:
+            failed = failed_jobs()
+            if failed:
+                raise click.ClickException(f'{failed} review(s) could not be scored; see the log for the errors')
+            break
+        time.sleep(interval)
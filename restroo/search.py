@@ -0,0 +1,190 @@
+import re
+from collections import Counter
+
+import click
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import joinedload
+
+from restroo import app, db
+from restroo.models import Post, Review, SearchTerm
+
+# Posts and reviews share one index; the document id encodes both the kind and the row id
+KINDS = {Post: 'post', Review: 'review'}
+KIND_CODES = {'post': 0, 'review': 1}
+MODELS = {'post': Post, 'review': Review}
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+_created = set()
+
+
+def doc_id(kind, ref_id):
+    return ref_id * len(KIND_CODES) + KIND_CODES[kind]
+
+
+def split_doc_id(value):
+    ref_id, code = divmod(value, len(KIND_CODES))
+    return next(kind for kind, c in KIND_CODES.items() if c == code), ref_id
+
+
+def words(value):
+    return [word.lower() for word in WORD.findall(value or '')]
+
+
+class Fts5Backend:
+    """SQLite FTS5 table ranked with bm25."""
+
+    def create(self, session):
+        session.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                             "title, content, rest_id UNINDEXED, category UNINDEXED, "
+                             "tokenize='porter unicode61')"))
+
+    def clear(self, session):
+        session.execute(text("DELETE FROM search_index"))
+
+    def remove(self, session, doc):
+        session.execute(text("DELETE FROM search_index WHERE rowid = :doc"), {'doc': doc})
+
+    def add(self, session, doc, title, content, rest_id, category):
+        session.execute(text("INSERT INTO search_index (rowid, title, content, rest_id, category) "
+                             "VALUES (:doc, :title, :content, :rest_id, :category)"),
+                        {'doc': doc, 'title': title, 'content': content, 'rest_id': rest_id, 'category': category})
+
+    def query(self, session, terms, kind, category, rest_id, limit, offset):
+        match = ' '.join('"%s"' % term for term in terms[:-1]) + ' "%s"*' % terms[-1]
+        sql = ("SELECT rowid, snippet(search_index, 1, '', '', '...', 24) FROM search_index "
+               "WHERE search_index MATCH :match")
+        params = {'match': match, 'limit': limit, 'offset': offset}
+        if kind:
+            sql += " AND rowid % :kinds = :code"
+            params.update(kinds=len(KIND_CODES), code=KIND_CODES[kind])
+        if category:
+            sql += " AND category = :category"
+            params['category'] = category
+        if rest_id:
+            sql += " AND rest_id = :rest_id"
+            params['rest_id'] = rest_id
+        sql += " ORDER BY bm25(search_index, 5.0, 1.0) LIMIT :limit OFFSET :offset"
+        return session.execute(text(sql), params).fetchall()
+
+
+class TermBackend:
+    """Plain inverted index in the search_term table, for databases without FTS5."""
+
+    def create(self, session):
+        pass
+
+    def clear(self, session):
+        session.query(SearchTerm).delete(synchronize_session=False)
+
+    def remove(self, session, doc):
+        session.query(SearchTerm).filter(SearchTerm.doc_id == doc).delete(synchronize_session=False)
+
+    def add(self, session, doc, title, content, rest_id, category):
+        # Title words count five times, mirroring the bm25 column weights used with FTS5
+        counts = Counter(words(content))
+        for word in words(title):
+            counts[word] += 5
+        if not counts:
+            return
+        session.execute(SearchTerm.__table__.insert(),
+                        [{'term': term[:64], 'doc_id': doc, 'rest_id': rest_id, 'category': category, 'weight': weight}
+                         for term, weight in counts.items()])
+
+    def query(self, session, terms, kind, category, rest_id, limit, offset):
+        query = session.query(SearchTerm.doc_id, db.func.sum(SearchTerm.weight).label('score')) \
+            .filter(SearchTerm.term.in_(terms))
+        if kind:
+            query = query.filter(SearchTerm.doc_id % len(KIND_CODES) == KIND_CODES[kind])
+        if category:
+            query = query.filter(SearchTerm.category == category)
+        if rest_id:
+            query = query.filter(SearchTerm.rest_id == rest_id)
+        query = query.group_by(SearchTerm.doc_id) \
+            .having(db.func.count(db.distinct(SearchTerm.term)) == len(set(terms))) \
+            .order_by(db.desc('score'), SearchTerm.doc_id.desc())
+        return [(doc, None) for doc, _ in query.limit(limit).offset(offset)]
+
+
+def get_backend(session=None):
+    session = session or db.session
+    bind = session.get_bind()
+    backend = Fts5Backend() if bind.dialect.name == 'sqlite' else TermBackend()
+    if bind.url not in _created:
+        backend.create(session)
+        _created.add(bind.url)
+    return backend
+
+
+def document(obj):
+    kind = KINDS[type(obj)]
+    return doc_id(kind, obj.id), obj.title, obj.content, obj.rest_id, getattr(obj, 'category', None)
+
+
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in ('title', 'content', 'category', 'rest_id')
+               if name in state.attrs)
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_search_index(session, flush_context):
+    # Runs inside the flush, so index changes commit or roll back together with the rows
+    backend = None
+    dirty, deleted = set(session.dirty), set(session.deleted)
+    for obj in list(session.new) + list(dirty) + list(deleted):
+        if type(obj) not in KINDS:
+            continue
+        if obj in dirty and not _changed(obj):
+            continue
+        backend = backend or get_backend(session)
+        doc = document(obj)
+        backend.remove(session, doc[0])
+        if obj not in deleted:
+            backend.add(session, *doc)
+
+
+def index_objects(objs):
+    backend = get_backend()
+    for obj in objs:
+        doc = document(obj)
+        backend.remove(db.session, doc[0])
+        backend.add(db.session, *doc)
+
+
+def search(q, kind=None, category=None, rest_id=None, page=1, per_page=10):
+    """Return ``(results, has_next)`` where results are ``(kind, object, snippet)`` in rank order."""
+    terms = words(q)
+    if not terms:
+        return [], False
+    rows = get_backend().query(db.session, terms, kind, category, rest_id, per_page + 1, (page - 1) * per_page)
+    has_next = len(rows) > per_page
+    hits = [(split_doc_id(doc), snippet) for doc, snippet in rows[:per_page]]
+
+    objects = {}
+    for name, model in MODELS.items():
+        ids = [ref_id for (kind_, ref_id), _ in hits if kind_ == name]
+        if ids:
+            relation = Post.author if model is Post else Review.reviewer
+            for obj in model.query.options(joinedload(relation)).filter(model.id.in_(ids)):
+                objects[name, obj.id] = obj
+    results = [(key[0], objects[key], snippet) for key, snippet in hits if key in objects]
+    return results, has_next
+
+
+def rebuild():
+    backend = get_backend()
+    backend.clear(db.session)
+    count = 0
+    for model in MODELS.values():
+        for obj in model.query.yield_per(1000):
+            backend.add(db.session, *document(obj))
+            count += 1
+    db.session.commit()
+    return count
+
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Rebuild the full-text search index from posts and reviews."""
+    click.echo(f'Indexed {rebuild()} document(s)')
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from restroo import app
+from restroo.metrics import sentiment_seconds, timed
+
+NLTK_PACKAGES = ('vader_lexicon', 'stopwords')
+
+
+class SentimentEngine:
+    """Process-wide VADER scorer with a bounded LRU cache keyed by content hash.
+
+    NLTK and its data are only imported on first use (or through ``load()``), and are
+    resolved from ``data_path`` and the standard NLTK locations without touching the network.
+    """
+
+    def __init__(self, cache_size=1024, data_path=None):
+        self.cache_size = cache_size
+        self.data_path = data_path
+        self._analyzer = None
+        self._stop_words = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._analyzer is None:
+            with self._lock:
+                if self._analyzer is None:
+                    import nltk
+                    from nltk.corpus import stopwords
+                    from nltk.sentiment import SentimentIntensityAnalyzer
+
+                    if self.data_path and self.data_path not in nltk.data.path:
+                        nltk.data.path.insert(0, self.data_path)
+                    try:
+                        self._stop_words = frozenset(stopwords.words('english'))
+                        self._analyzer = SentimentIntensityAnalyzer()
+                    except LookupError as e:
+                        raise LookupError(f'NLTK data {NLTK_PACKAGES} not found under {self.data_path!r} '
+                                          f'or the default NLTK paths; run `flask nltk-download` on a '
+                                          f'connected machine or set RESTROO_NLTK_DATA') from e
+        return self._analyzer
+
+    def _compute(self, text):
+        analyzer = self.load()
+        with timed(sentiment_seconds):
+            processed = ' '.join(word for word in text.split() if word not in self._stop_words)
+            scores = analyzer.polarity_scores(text=processed)
+        return round((1 + scores['compound']) / 2, 2)
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, text):
+        text = text.lower()
+        key = self._key(text)
+        value = self._get(key)
+        if value is None:
+            value = self._compute(text)
+            self._put(key, value)
+        return value
+
+    def score_many(self, texts):
+        texts = [text.lower() for text in texts]
+        keys = [self._key(text) for text in texts]
+        results = {}
+        for key, text in zip(keys, texts):
+            if key in results:
+                continue
+            value = self._get(key)
+            if value is None:
+                value = self._compute(text)
+                self._put(key, value)
+            results[key] = value
+        return [results[key] for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+sentiment_engine = SentimentEngine(cache_size=app.config['SENTIMENT_CACHE_SIZE'],
+                                   data_path=app.config['NLTK_DATA'])
+
+
+def warm_up():
+    sentiment_engine.load()
+    return sentiment_engine
+
+
+@app.cli.command('nltk-download')
+def nltk_download_command():
+    """Download the NLTK data used for review scoring into NLTK_DATA."""
+    import nltk
+
+    for package in NLTK_PACKAGES:
+        nltk.download(package, download_dir=app.config['NLTK_DATA'])
@@ -5,4 +5,51 @@ function creatediv() {
     } else {
         x.style.display = 'none';
     }
-}
\ No newline at end of file
+}
+
+// Live updates for the booking pages, pushed by the server over Server-Sent Events
+function watchAvailability(url) {
+    if (!window.EventSource) {
+        return;
+    }
+    var source = new EventSource(url);
+    function update(slot) {
+        var cell = document.querySelector('td[data-slot="' + slot.slot + '"]');
+        if (cell) {
+            cell.querySelector('.available').textContent = slot.available;
+            cell.classList.toggle('text-muted', slot.available == 0);
+        }
+        var option = document.querySelector('#slot option[value="' + slot.slot + '"]');
+        if (option) {
+            option.disabled = slot.available == 0;
+        }
+    }
+    source.addEventListener('slots', function (e) {
+        JSON.parse(e.data).forEach(update);
+    });
+    source.addEventListener('availability', function (e) {
+        update(JSON.parse(e.data));
+    });
+}
+
+function watchBookings(url) {
+    if (!window.EventSource) {
+        return;
+    }
+    var source = new EventSource(url);
+    function notify(text) {
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-info';
+        alert.textContent = text + ' Reload the page to see it.';
+        document.getElementById('live-bookings').appendChild(alert);
+    }
+    source.addEventListener('booking', function (e) {
+        var booking = JSON.parse(e.data);
+        notify('New booking: ' + booking.customer + ', ' + booking.number_of_table + ' table(s) at ' +
+               booking.slot.replace('T', ' ') + '.');
+    });
+    source.addEventListener('cancelled', function (e) {
+        var booking = JSON.parse(e.data);
+        notify('Booking #' + booking.id + ' was cancelled.');
+    });
+}
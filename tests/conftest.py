@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from restroo import app, db, migrations
+from restroo.models import User
+
+SETTINGS = dict(TESTING=True, WTF_CSRF_ENABLED=False, SCORING_MODE='external', IMAGE_PROCESSING='sync',
+                PAGE_CACHE=False, IDENTITY_CACHE=False, BCRYPT_LOG_ROUNDS=4)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A migrated SQLite database in a temporary directory.
+
+    No app context is left pushed, so each test client request gets its own, as in a server.
+    """
+    saved = dict(app.config)
+    app.config.update(SETTINGS, SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(tmp_path, 'test.db'),
+                      EVENTS_DIR=os.path.join(tmp_path, 'events'), PAGE_CACHE_DIR=os.path.join(tmp_path, 'page_cache'))
+    with app.app_context():
+        migrations.upgrade()
+    yield db
+    db.get_engine(app).dispose()
+    app.config.clear()
+    app.config.update(saved)
+
+
+@pytest.fixture
+def app_context(database):
+    with app.app_context():
+        yield
+        db.session.remove()
+
+
+def make_user(username, role='customer'):
+    user = User(name=username.title(), username=username, email=f'{username}@example.com', address='Somewhere',
+                contact=1000, role=role, password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
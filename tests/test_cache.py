@@ -0,0 +1,72 @@
+import os
+import pickle
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+from restroo import app, cache, db
+from restroo.models import Post
+from tests.conftest import make_user
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Another process on the host, e.g. a second worker or a CLI command, adding a post
+ADD_POST = '''
+from restroo import app, db
+from restroo.models import Post
+with app.app_context():
+    db.session.add(Post(title='Second post', content='Truffles', category='Food', rest_id=1))
+    db.session.commit()
+'''
+
+
+@pytest.fixture
+def page_cache(database, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'PAGE_CACHE', True)
+    monkeypatch.setattr(cache, 'tag_versions', cache.TagVersions(str(tmp_path / 'cache_tags'), 300))
+    cache.page_cache.clear()
+    yield cache.page_cache
+    cache.page_cache.clear()
+
+
+def test_write_in_another_process_retires_cached_pages(page_cache, tmp_path):
+    with app.app_context():
+        rest = make_user('rest', 'restaurant')
+        db.session.add(Post(title='First post', content='Pasta', category='Food', rest_id=rest.id))
+        db.session.commit()
+        db.session.remove()
+    client = app.test_client()
+    assert b'First post' in client.get('/home').data
+    # Served from this process's cache without touching the database
+    assert client.get('/home').headers['X-Query-Count'] == '0'
+
+    env = dict(os.environ, PYTHONPATH=ROOT, RESTROO_DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'],
+               RESTROO_PAGE_CACHE_TAGS_DIR=cache.tag_versions.directory,
+               RESTROO_EVENTS_DIR=app.config['EVENTS_DIR'])
+    subprocess.run([sys.executable, '-c', ADD_POST], env=env, cwd=tmp_path, check=True)
+
+    assert b'Second post' in client.get('/home').data
+
+
+def test_tag_versions_are_shared_between_instances(tmp_path):
+    one, other = cache.TagVersions(str(tmp_path), 300), cache.TagVersions(str(tmp_path), 300)
+    version = one.get('posts')
+    assert other.get('posts') == version
+    other.bump('posts')
+    assert one.get('posts') != version
+
+
+def test_file_cache_round_trips_pages(tmp_path):
+    entry = (b'<html>\xc3\xa9</html>', 'text/html', 'abc', datetime(2024, 5, 1, 12, 30), {'posts': 'v1'})
+    cache.FileCache(str(tmp_path), 10, 300).set('page|home', entry)
+    assert cache.FileCache(str(tmp_path), 10, 300).get('page|home') == entry
+
+
+def test_file_cache_ignores_files_it_cannot_parse(tmp_path):
+    files = cache.FileCache(str(tmp_path), 10, 300)
+    with open(files._path('page|home'), 'wb') as f:
+        pickle.dump((time.time() + 300, 'planted'), f)
+    assert files.get('page|home') is None
@@ -0,0 +1,53 @@
+import os
+import runpy
+
+import pytest
+from gunicorn.config import Config
+
+from restroo import app, db, events
+from restroo.models import Tables
+from tests.conftest import make_user
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_worker(threads):
+    # What gunicorn does for each worker it forks with the bundled settings
+    cfg = Config()
+    cfg.set('threads', threads)
+    worker = cfg.worker_class(0, os.getpid(), [], None, 30, cfg, None)
+    runpy.run_path(os.path.join(ROOT, 'gunicorn.conf.py'))['post_fork'](None, worker)
+
+
+@pytest.fixture
+def restaurant(database, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', app.config['EVENTS_MAX_STREAMS'])
+    monkeypatch.delenv('RESTROO_EVENTS_MAX_STREAMS', raising=False)
+    with app.app_context():
+        rest_id = make_user('rest', 'restaurant').id
+        db.session.add(Tables(rest_id=rest_id, total=5, available=5))
+        db.session.commit()
+    return rest_id
+
+
+def test_sync_worker_never_holds_a_stream_open(restaurant):
+    start_worker(threads=1)
+
+    for _ in range(3):
+        response = app.test_client().get(f'/bookings/{restaurant}/events')
+        assert response.status_code == 200
+        # A complete answer of known length: a retry delay and the current availability
+        assert 'Content-Length' in response.headers
+        body = response.get_data(as_text=True)
+        assert body.startswith(f"retry: {app.config['EVENTS_RETRY_MS']}\n\n")
+        assert 'event: slots\n' in body
+    assert events._open_streams == 0
+
+
+def test_threaded_worker_streams_on_half_its_threads(restaurant):
+    start_worker(threads=4)
+    assert app.config['EVENTS_MAX_STREAMS'] == 2
+
+    response = app.test_client().get(f'/bookings/{restaurant}/events', buffered=False)
+    assert 'Content-Length' not in response.headers
+    response.close()
@@ -0,0 +1,17 @@
+from restroo import db
+from restroo.models import RestaurantRank, Review, ReviewAggregate
+from tests.conftest import make_user
+
+
+def test_scoring_a_review_updates_aggregate_and_rank_in_one_flush(app_context):
+    rest, cust = make_user('rest', 'restaurant'), make_user('cust')
+    review = Review(title='Dinner', content='Lovely', rest_id=rest.id, cust_id=cust.id, sentiment=None)
+    db.session.add(review)
+    db.session.commit()
+    assert RestaurantRank.query.get(rest.id).avg_sentiment is None
+
+    review.sentiment = 0.8
+    db.session.commit()
+    assert ReviewAggregate.query.get(rest.id).review_count == 1
+    rank = RestaurantRank.query.get(rest.id)
+    assert (rank.review_count, rank.avg_sentiment) == (1, 0.8)
@@ -0,0 +1,65 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from restroo import app, metrics, profiler
+from tests.conftest import make_user
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_DIR', str(tmp_path))
+    metrics.reset()
+    yield str(tmp_path)
+    metrics.reset()
+
+
+def test_collect_adds_up_every_worker(metrics_dir):
+    metrics.booking_conflicts.inc('full')
+    # Another worker's values
+    with open(os.path.join(metrics_dir, '1.json'), 'w') as f:
+        json.dump({metrics.booking_conflicts.name: [[['full'], 2], [['locked'], 1]]}, f)
+
+    totals = metrics.collect()[metrics.booking_conflicts.name]
+    assert totals == {('full',): 3, ('locked',): 1}
+
+
+class Exploit:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def test_collect_never_unpickles(metrics_dir):
+    # Files planted by anyone who can write to the directory
+    marker = os.path.join(metrics_dir, 'unpickled')
+    for name in ('1.pickle', '2.json'):
+        with open(os.path.join(metrics_dir, name), 'wb') as f:
+            pickle.dump(Exploit(marker), f)
+
+    metrics.collect()
+    assert not os.path.exists(marker)
+
+
+def test_streamed_responses_are_not_profiled(database, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROFILE_SLOW_REQUESTS', 0.001)
+    monkeypatch.setitem(app.config, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    with app.app_context():
+        rest_id = make_user('rest', 'restaurant').id
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(rest_id)
+
+    # The export keeps its request context until the last row is sent
+    response = client.get(f'/bookings/{rest_id}/export.csv', buffered=False)
+    assert response.is_streamed
+    chunks = iter(response.response)
+    next(chunks)
+    assert not profiler.get_sampler()._stacks
+    list(chunks)
+    response.close()
+    assert not os.path.exists(app.config['PROFILE_DIR'])
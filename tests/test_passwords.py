@@ -0,0 +1,47 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from restroo import app, passwords
+
+# Another worker on the host holding the only hashing slot until its stdin closes
+HOLD_SLOT = '''
+import fcntl, os, sys
+fd = os.open(os.path.join(sys.argv[1], '0.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print('holding', flush=True)
+sys.stdin.read()
+'''
+
+
+@pytest.fixture
+def one_slot(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_SLOTS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT', 0.2)
+    monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 4)
+    return str(tmp_path)
+
+
+def test_hashing_is_refused_while_another_process_holds_every_slot(one_slot):
+    holder = subprocess.Popen([sys.executable, '-c', HOLD_SLOT, one_slot], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline() == 'holding\n'
+        started = time.monotonic()
+        with pytest.raises(passwords.HashingBusy):
+            passwords.hash_password('secret')
+        assert time.monotonic() - started < 1
+    finally:
+        holder.stdin.close()
+        holder.wait()
+
+    # The slot is free again once the other process lets go of it
+    assert passwords.hash_password('secret').startswith('$2b$04$')
+
+
+def test_slot_is_released_after_a_hash(one_slot):
+    for _ in range(3):
+        passwords.hash_password('secret')
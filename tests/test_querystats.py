@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy.orm import lazyload
+
+from restroo import app, db, routes
+from restroo.models import Post
+from restroo.querystats import QueryBudgetExceeded
+from tests.conftest import make_user
+
+
+@pytest.fixture
+def feed(database):
+    # Enough posts by enough authors that loading each author separately would blow the budget
+    with app.app_context():
+        for i in range(app.config['FEED_PER_PAGE']):
+            author = make_user(f'rest{i}', 'restaurant')
+            db.session.add(Post(title=f'Post {i}', content='Fresh pasta', category='Food', rest_id=author.id))
+        db.session.commit()
+        db.session.remove()
+
+
+def test_route_under_budget_passes(feed):
+    response = app.test_client().get('/home')
+    assert response.status_code == 200
+    assert int(response.headers['X-Query-Count']) <= app.view_functions['home'].query_budget
+
+
+def test_route_over_budget_fails(feed, monkeypatch):
+    # Loading each post's author on its own is the N+1 the budget is there to catch
+    monkeypatch.setattr(routes, 'joinedload', lazyload)
+    with pytest.raises(QueryBudgetExceeded, match=r'home ran \d+ queries \(budget 4\)'):
+        app.test_client().get('/home')
+
+
+def test_budget_overruns_are_logged_outside_tests(feed, monkeypatch, caplog):
+    monkeypatch.setattr(routes, 'joinedload', lazyload)
+    monkeypatch.setitem(app.config, 'TESTING', False)
+    monkeypatch.setitem(app.config, 'QUERY_ACCOUNTING', True)
+    assert app.test_client().get('/home').status_code == 200
+    assert 'home ran' in caplog.text
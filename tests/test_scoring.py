@@ -0,0 +1,50 @@
+from restroo import app, db, scoring
+from restroo.models import Review, ScoringJob
+from restroo.sentiment import sentiment_engine
+from tests.conftest import make_user
+
+
+def queue_reviews(contents):
+    rest, cust = make_user('rest', 'restaurant'), make_user('cust')
+    for content in contents:
+        review = Review(title='Dinner', content=content, rest_id=rest.id, cust_id=cust.id)
+        scoring.queue_review(review)
+        db.session.add(review)
+    db.session.commit()
+
+
+def fake_score_many(texts):
+    if 'bad' in texts:
+        raise ValueError('cannot score')
+    return [0.5 for _ in texts]
+
+
+def test_drain_scores_the_jobs_after_a_failing_one(app_context, monkeypatch):
+    monkeypatch.setattr(sentiment_engine, 'score_many', fake_score_many)
+    queue_reviews(['bad', 'good', 'fine', 'tasty'])
+
+    # A batch of one, so the first batch fails entirely
+    assert scoring.drain(batch_size=1) == 3
+    assert scoring.unfinished_jobs() == []
+    statuses = {review.content: (review.scoring_job.status, review.sentiment) for review in Review.query}
+    assert statuses == {'bad': ('failed', None), 'good': ('done', '0.5'), 'fine': ('done', '0.5'),
+                        'tasty': ('done', '0.5')}
+    assert ScoringJob.query.filter_by(status='failed').one().attempts == app.config['SCORING_MAX_ATTEMPTS']
+
+
+def test_failing_review_does_not_fail_its_batch(app_context, monkeypatch):
+    monkeypatch.setattr(sentiment_engine, 'score_many', fake_score_many)
+    queue_reviews(['good', 'bad', 'fine'])
+
+    assert scoring.drain(batch_size=10) == 2
+    assert scoring.failed_jobs() == 1
+
+
+def test_score_reviews_command_reports_failures(app_context, monkeypatch):
+    monkeypatch.setattr(sentiment_engine, 'score_many', fake_score_many)
+    queue_reviews(['good', 'bad'])
+
+    result = app.test_cli_runner().invoke(scoring.score_reviews_command)
+    assert result.exit_code == 1
+    assert 'Scored 1 review(s)' in result.output
+    assert '1 review(s) could not be scored' in result.output
@@ -0,0 +1,27 @@
+"""Production entry point, served by gunicorn with the settings in gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported and warmed once in the master process before the workers are forked,
+so they share the loaded models, compiled templates and imported code copy-on-write.
+"""
+import gc
+
+from restroo import app, db
+from restroo.sentiment import warm_up as warm_up_sentiment
+
+
+def warm_up():
+    warm_up_sentiment()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        engine = db.get_engine(app)
+        engine.execute('SELECT 1')
+        # Connections must not be shared across fork; each worker opens its own pool
+        engine.dispose()
+
+
+warm_up()
+# Keep the garbage collector from touching (and so un-sharing) everything loaded so far
+gc.freeze()